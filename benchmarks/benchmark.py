@@ -0,0 +1,231 @@
+# Benchmarks for the audio and feature pipeline
+#
+# Runs every stage (open, frame, window, preemphasise, energy and mfcc) on
+# synthetic signals of several lengths and writes the results as JSON so
+# that versions can be compared, e.g.
+#
+#   python benchmark.py --output before.json
+#   ... change things ...
+#   python benchmark.py --output after.json --compare before.json
+#
+# Each measurement runs in its own process so that the memory figures of one
+# stage do not hide those of another. Throughput is seconds of audio processed
+# per CPU second, memory is the growth of the peak resident set size during
+# the stage (so it is a lower bound when the setup already used more).
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import AudioFile
+import algorithms
+
+
+############### CASES ###############
+
+def _opened(path, **kwargs):
+    """ An opened audio file """
+    return AudioFile.AudioFile(path, **kwargs)
+
+def _framed(path):
+    """ An opened audio file that has been framed with the defaults """
+    af = _opened(path)
+    af.frame()
+    return af
+
+def _windowed(path):
+    """ Windowed frames with the defaults """
+    return np.array(_opened(path).window())
+
+def _cases(orders, fftLens):
+    """ List of (stage, variant, file type, setup(path), run(state)) """
+    cases = [
+        ('open', 'raw', 'raw', lambda p: p, lambda p: _opened(p)),
+        ('open', 'raw mmap', 'raw', lambda p: p, lambda p: _opened(p, mmap = True)),
+        ('open', 'wav', 'wav', lambda p: p, lambda p: _opened(p)),
+        ('frame', 'pad centred', 'raw', _opened, lambda af: af.frame(0.005, 0.025, True, True)),
+        ('frame', 'pad', 'raw', _opened, lambda af: af.frame(0.005, 0.025, True, False)),
+        ('frame', 'no pad', 'raw', _opened, lambda af: af.frame(0.005, 0.025, False, False)),
+        ('preemphasise', '0.97', 'raw', _framed, lambda af: af.preemphasise(0.97)),
+        ('windowFrames', 'preemphasised', 'raw', _opened, lambda af: af.windowFrames(0.97)),
+        ('energy', '', 'raw', _windowed, lambda w: algorithms.energy(w)),
+    ]
+    for windowType in algorithms.windowTypes:
+        cases.append(('window', windowType, 'raw', _framed,
+                      lambda af, windowType = windowType: af.window(windowType, kaiserBeta = 8.0)))
+    for order in orders:
+        for fftLen in fftLens:
+            cases.append(('mfcc', 'order {0} fft {1}'.format(order, fftLen or 'frame'), 'raw', _windowed,
+                          lambda w, order = order, fftLen = fftLen: algorithms.mfcc(w, order, _rate, fftLen)))
+    return cases
+
+
+############### MEASUREMENT ###############
+
+_rate = 16000 # set from the command line before any case runs
+
+def _cpu():
+    """ CPU (user + system) seconds used by this process """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def _maxrss():
+    """ Peak resident set size of this process in bytes """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _measure(case, path, repeats, minTime, queue):
+    """ Runs one case in this (child) process and puts the best timings on the queue 
+    
+    Each repeat runs the stage (with a fresh setup every time) until it has
+    used at least minTime CPU seconds and records the average, the best 
+    repeat is kept
+    """
+    stage, variant, _, setup, run = case
+    result = {'cpu':None, 'wall':None, 'memory':0, 'runs':0}
+    try:
+        for r in range(repeats):
+            cpuTotal, wallTotal, runs = 0.0, 0.0, 0
+            while runs == 0 or cpuTotal < minTime:
+                state = setup(path)
+                before = _maxrss()
+                cpu, wall = _cpu(), time.time()
+                run(state)
+                cpuTotal += _cpu() - cpu
+                wallTotal += time.time() - wall
+                result['memory'] = max(result['memory'], _maxrss() - before)
+                runs += 1
+                del state
+            cpu, wall = cpuTotal / runs, wallTotal / runs
+            result['cpu'] = cpu if result['cpu'] is None else min(result['cpu'], cpu)
+            result['wall'] = wall if result['wall'] is None else min(result['wall'], wall)
+            result['runs'] += runs
+        result['peakMemory'] = _maxrss()
+    except Exception as e:
+        result['error'] = '{0}: {1}'.format(type(e).__name__, e)
+    queue.put(result)
+
+def _run(case, path, repeats, minTime):
+    """ Runs one case in a fresh process """
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target = _measure, args = (case, path, repeats, minTime, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+############### SIGNALS ###############
+
+def _writeSignals(directory, seconds, rate, seed):
+    """ Writes a reproducible noisy harmonic signal as raw float32 and 16 bit wav files """
+    rng = np.random.RandomState(seed)
+    n = int(seconds * rate)
+    raw = os.path.join(directory, 'signal{0}.raw'.format(seconds))
+    wav = os.path.join(directory, 'signal{0}.wav'.format(seconds))
+    block = 1 << 20
+    with open(raw, 'wb') as rawFile:
+        with open(wav, 'wb') as wavFile:
+            wavFile.write(b'RIFF' + struct.pack('<I', 36 + 2 * n) + b'WAVEfmt ' +
+                          struct.pack('<IHHIIHH', 16, 1, 1, rate, 2 * rate, 2, 16) +
+                          b'data' + struct.pack('<I', 2 * n))
+            for start in range(0, n, block):
+                t = np.arange(start, min(n, start + block)) / float(rate)
+                x = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.1 * np.sin(2 * np.pi * 1330 * t) + 0.05 * rng.randn(t.size)
+                x.astype(np.float32).tofile(rawFile)
+                (x * 32767).astype('<i2').tofile(wavFile)
+    return {'raw':raw, 'wav':wav}
+
+
+############### REPORTING ###############
+
+def _key(result):
+    return (result['stage'], result['variant'], result['seconds'])
+
+def _compare(results, baseline):
+    """ Prints the throughput ratio of these results to the baseline """
+    old = dict((_key(r), r) for r in baseline['results'])
+    print '\n{0:<14} {1:<22} {2:>8} {3:>10} {4:>10} {5:>7}'.format('stage', 'variant', 'seconds', 'before', 'after', 'ratio')
+    for r in results:
+        o = old.get(_key(r))
+        if o is None or not o.get('throughput') or not r.get('throughput'):
+            continue
+        print '{0:<14} {1:<22} {2:>8} {3:>10.1f} {4:>10.1f} {5:>7.2f}'.format(
+            r['stage'], r['variant'], r['seconds'], o['throughput'], r['throughput'], r['throughput'] / o['throughput'])
+
+def _meta(args):
+    """ Details of the environment the results came from """
+    import scipy
+    return {'time':time.strftime('%Y-%m-%dT%H:%M:%S'), 'python':platform.python_version(),
+            'numpy':np.__version__, 'scipy':scipy.__version__, 'platform':platform.platform(),
+            'processor':platform.processor(), 'rate':args.rate, 'repeats':args.repeats, 'minTime':args.minTime,
+            'seed':args.seed}
+
+
+def main(argv = None):
+    global _rate
+    parser = argparse.ArgumentParser(description = 'Benchmark the PYSpeechLib pipeline')
+    parser.add_argument('--lengths', type = float, nargs = '+', default = [1, 10, 60, 600, 3600],
+                        help = 'signal lengths in seconds (default 1 10 60 600 3600)')
+    parser.add_argument('--rate', type = int, default = 16000, help = 'sampling rate in Hz (default 16000)')
+    parser.add_argument('--orders', type = int, nargs = '+', default = [13, 60], help = 'MFCC orders (default 13 60)')
+    parser.add_argument('--fft', type = int, nargs = '+', default = [0, 1024],
+                        help = 'FFT lengths, 0 for the frame width (default 0 1024)')
+    parser.add_argument('--stages', nargs = '+', default = None, help = 'only run these stages')
+    parser.add_argument('--repeats', type = int, default = 3, help = 'runs per case, the fastest is kept (default 3)')
+    parser.add_argument('--min-time', type = float, default = 0.2, dest = 'minTime',
+                        help = 'minimum CPU seconds per repeat, short stages are run several times (default 0.2)')
+    parser.add_argument('--seed', type = int, default = 0, help = 'random seed for the signals (default 0)')
+    parser.add_argument('--output', default = 'benchmark.json', help = 'results file (default benchmark.json)')
+    parser.add_argument('--compare', default = None, help = 'earlier results file to compare against')
+    args = parser.parse_args(argv)
+    _rate = args.rate
+
+    cases = _cases(args.orders, [f or None for f in args.fft])
+    if args.stages:
+        cases = [c for c in cases if c[0] in args.stages]
+
+    results = []
+    directory = tempfile.mkdtemp(prefix = 'pyspeechlib')
+    try:
+        for seconds in args.lengths:
+            paths = _writeSignals(directory, seconds, args.rate, args.seed)
+            for case in cases:
+                result = _run(case, paths[case[2]], args.repeats, args.minTime)
+                result.update({'stage':case[0], 'variant':case[1], 'seconds':seconds})
+                if result.get('cpu'):
+                    result['throughput'] = seconds / result['cpu']
+                results.append(result)
+                if 'error' in result:
+                    print '{0:<14} {1:<22} {2:>8} {3}'.format(case[0], case[1], seconds, result['error'])
+                else:
+                    print '{0:<14} {1:<22} {2:>8} {3:>9.4f}s cpu {4:>12.1f} x realtime {5:>8.1f} MB'.format(
+                        case[0], case[1], seconds, result['cpu'], result.get('throughput', float('inf')),
+                        result['memory'] / 1e6)
+            for path in paths.values():
+                os.remove(path)
+    finally:
+        shutil.rmtree(directory)
+
+    with open(args.output, 'w') as f:
+        json.dump({'meta':_meta(args), 'results':results}, f, indent = 1, sort_keys = True)
+    print 'Results written to {0}'.format(args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            _compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# Import time regression check
+#
+# Imports each of the library modules in a fresh interpreter and fails (exit
+# status 1) if any of them loads SciPy, which is only needed once an FFT or DCT
+# is computed, or takes longer than the budget on top of importing NumPy, e.g.
+#
+#   python importtime.py --budget 0.05
+#
+# The time is the best of several runs so that a busy machine does not cause
+# false failures.
+
+import argparse
+import os
+import subprocess
+import sys
+
+_src = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# prints the import time and whether scipy was loaded
+_probe = """
+import sys, time
+start = time.time()
+import {0}
+print('{{0}} {{1}}'.format(time.time() - start, int(any(m.split('.')[0] == 'scipy' for m in sys.modules))))
+"""
+
+def importTime(module, repeats):
+    """ Best import time of module in a fresh interpreter and whether it loaded scipy """
+    best, scipy = None, False
+    for r in range(repeats):
+        output = subprocess.check_output([sys.executable, '-c', _probe.format(module)], cwd = _src)
+        seconds, loaded = output.split()
+        best = float(seconds) if best is None else min(best, float(seconds))
+        scipy = scipy or loaded == b'1'
+    return best, scipy
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Check the import time of the PYSpeechLib modules')
+    parser.add_argument('--budget', type = float, default = 0.1,
+                        help = 'seconds allowed on top of importing numpy (default 0.1)')
+    parser.add_argument('--repeats', type = int, default = 5, help = 'runs per module, the fastest is kept (default 5)')
+    parser.add_argument('--modules', nargs = '+', default = ['algorithms', 'AudioFile', 'SpeechFeatures',
+                        'OnlineFeatures', 'FeatureCache', 'FeatureWriter'], help = 'modules to check')
+    args = parser.parse_args(argv)
+
+    numpyTime, _ = importTime('numpy', args.repeats)
+    print '{0:<16} {1:>8.4f}s'.format('numpy', numpyTime)
+    failed = False
+    for module in args.modules:
+        seconds, scipy = importTime(module, args.repeats)
+        problems = []
+        if scipy:
+            problems.append('loads scipy')
+        if seconds - numpyTime > args.budget:
+            problems.append('over budget by {0:.4f}s'.format(seconds - numpyTime - args.budget))
+        print '{0:<16} {1:>8.4f}s {2}'.format(module, seconds, ', '.join(problems) or 'ok')
+        failed = failed or bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,17 +1,31 @@
 # Contains file that can be heard, not parameters
 
+import itertools
 import numpy as np
 import os
+import re
+import struct
 import warnings
 
+import algorithms
+from algorithms import instrument
+import Config
+
+# source of AudioFile._dataVersion, no two versions of the data of any files share one
+_dataVersions = itertools.count(1)
+
+_defaultFrameConfig = Config.FrameConfig()
+_defaultWindowConfig = Config.WindowConfig()
+
 
 class AudioFile:
     """
     Audio file data
   
     Audio file objects store the raw data associated with a file and provide functionality
-    for creating framed and windowed versions of the file for processing. Currently only supports
-    mono file
+    for creating framed and windowed versions of the file for processing. Multi-channel
+    files are kept as (samples, channels) and their frames, windows and features have a 
+    leading channel axis, all channels are processed together
   
     Methods
     -------
@@ -20,8 +34,11 @@ class AudioFile:
         open:         Opens an audio file
         frame:        Returns a version of the file broken down into frames
         window:       Returns a version of the file that has been broken down and had a windowing function applied
+        iterFrames:   Iterates over blocks of framed and windowed data without storing the whole file
+        windowFrames: Frames, preemphasises and windows in a single stage without storing the result
         preemphasise: applies the preemphasis transform
         unemphasise:  reverses the preemphasis
+        resample:     resamples the data to a new sampling rate
     
     Attributes (should be treated as read only)
     ----------
@@ -31,7 +48,8 @@ class AudioFile:
         rate:          The sampling rate of the original audio in Hz (eg 48000)
         encoding:      What type of data was stored [float, double, integer, short, char, ascii]
         bitdepth:      The size of each sample (eg 16)
-        data:          The original audio data
+        data:          The original audio data, (samples, channels)
+        channels:      Number of channels
         length:        Length of the audio (sec)
         frameshift:    Shift between frames in the current stored version
         framewidth:    Length of the frames in the current stored version
@@ -40,24 +58,48 @@ class AudioFile:
         kaiserBeta:    What was the value of the kaiser beta in the window
         preemphasised: Has the data been pre-emphasised
         alpha:         pre-emphasis constant
+        dtype:         Floating point type for frames and windows, None for float64
     
     
     Private methods and attributes
     ------------------------------
       _setEncoding(encoding) Sets the encoding following all rules
-      _openRaw(endian)       Reads a raw file
-      _openAscii()           Reads an ASCII file
+      _openRaw(endian, mmap) Reads (or memory maps) a raw file
+      _openAscii(sidecar, mmap) Reads an ASCII file, or its binary sidecar
+      _parseAscii()          Parses the values of an ASCII file in blocks
+      _rowLengths(text)      Number of values on each non empty line of some ASCII text
+      _readSidecar(mmap)     Reads (or memory maps) the binary sidecar of an ASCII file if it is up to date
+      _writeSidecar(...)     Writes the binary sidecar of an ASCII file
+      _openWav(mmap)         Reads (or memory maps) a WAV file
+      _readSamples(...)      Reads or memory maps binary samples from the file
+      _frameSettings(...)    Resolves frame and window settings without storing them
+      _configs(...)          Resolves the FrameConfig and WindowConfig without storing them
+      _frameConfigFrom(...)  FrameConfig from some values and the current settings
+      _windowConfigFrom(...) WindowConfig from some values and the current settings
+      _frameConfig           Settings of the framed data
+      _windowConfig          Settings of the windowed data
+      _windowKey             Frame and window settings and preemphasis of the windowed data
+      _dataVersion           Identifies the data, unique to each file opened or resampled by any AudioFile
       _framedData            Framed version of the data
       _frameshiftPT          The frame shift in data points
       _framewidthPT          The frame length in data points
       _framedPadded          Was the frame padded
       _framedCentred         Was the frame centred
       _windowedData          The framed data that has been windowed
+      _emphasisedData        Preemphasised versions of the framed data by alpha
+      _emphasised()          The preemphasised frames for the current alpha
+      _emphasise(framed)     Preemphasised copy of some frames with the current alpha
     """
   
   
-    def __init__(self, fileID = None, fType = '', rate = 48000, encoding='float', bitdepth=32, **kwargs):
-        """ Constructor, can be used as interface to Open """
+    def __init__(self, fileID = None, fType = '', rate = 48000, encoding='float', bitdepth=32, dtype = None, **kwargs):
+        """ Constructor, can be used as interface to Open 
+        
+        dtype sets the floating point type of the frames and windows (e.g. numpy.float32),
+        by default they are float64 whatever the type of the data.
+        It is kept when other files are opened.
+        """
+        self.dtype = None if dtype is None else np.dtype(dtype)
         self.EncodingSubstitutions = {'f':'float',
                              's':'short',
                              'd':'double',
@@ -81,6 +123,7 @@ class AudioFile:
         self.bitdepth = 0          # size of each same (ASCII will be returned as None)
         self.encoding = ''         # type of encoding e.g. float
         self.data = None           # the actual audio data (numpy array)
+        self.channels = 0          # number of channels, the columns of data
         self.read = False          # keeps track of if the file was sucessfully opened and read
         self.length = 0.0          # length of the file in seconds
         self.frameshift = None     # frame shift used for frame and window functions in seconds
@@ -98,6 +141,11 @@ class AudioFile:
         self._framedPadded = None  # Was the framed version padded
         self._framedCentred = None # Was the framed version centered if it was padded
         self._windowedData = None  # windowed version of the data 
+        self._emphasisedData = {}  # preemphasised versions of the framed data by alpha
+        self._frameConfig = None   # settings of the framed data
+        self._windowConfig = None  # settings of the windowed data
+        self._windowKey = None     # settings and preemphasis of the windowed data
+        self._dataVersion = next(_dataVersions) # identifies the data, new whenever it changes
     
     
     def close(self):
@@ -114,7 +162,7 @@ class AudioFile:
         ----------
             fileID : string or file object
                 File name or object to be read
-            fType  : {'raw', 'ascii'}, optional
+            fType  : {'raw', 'ascii', 'wav'}, optional
                 Type of file to be read, default infered from the file name
             fRate  : integer (Hz), optional
                 Sampling speed of the audio file, default 48000 if raw, otherwise always read from file and ignored
@@ -135,6 +183,17 @@ class AudioFile:
         ----------------------
             endian = {'=','>','<'}
                 endianess in order: (machine, big, little), default is machine, only used for raw files
+            mmap = {True, False}
+                memory map the file rather than reading it, the data is then only read from disk
+                when it is used (e.g. by frame or window), default is False, only used for raw and wav files
+                and the sidecars of ascii files
+            sidecar = {True, False}
+                for ascii files, keep the parsed values in a binary file next to the text file 
+                (its name plus '.f64') and read that instead while the text file's size and 
+                modification time are unchanged, default is False
+            channels = int
+                number of interleaved channels, default 1, only used for raw and ascii files.
+                The channels are a strided view of the samples, nothing is copied
         
         Returns
         -------
@@ -148,11 +207,13 @@ class AudioFile:
             IOError
                 If file can not be found
             ValueError
-                If endian is not understood in raw files
+                If endian is not understood in raw files or a wav file is not supported
+                or channels is not positive
         """
         
         # function inputs
-        defaults = {'fType':fType, 'rate':rate, 'encoding':encoding, 'bitdepth':bitdepth, 'endian':'='}
+        defaults = {'fType':fType, 'rate':rate, 'encoding':encoding, 'bitdepth':bitdepth, 'endian':'=', 'mmap':False, 'channels':1,
+                    'sidecar':False}
         for key in kwargs:
             if key not in defaults.keys():
                 raise KeyError('Unknown key in AudioFile.Open: ' + str(key))
@@ -164,6 +225,10 @@ class AudioFile:
       
         self.fileID = fileID
         
+        self.channels = int(kwargs['channels'])
+        if self.channels < 1:
+            raise ValueError('AudioFile.open needs at least one channel')
+        
         self.rate = float(kwargs['rate'])
       
         if kwargs['bitdepth'] is None:
@@ -188,22 +253,30 @@ class AudioFile:
         if self.fType == 'txt' or self.encoding == 'ascii': 
             self.fType = 'ascii'
             kwargs['encoding'] = 'ascii'
-        validFileTypes = ['raw', 'ascii']
+        if self.fType == 'wave':
+            self.fType = 'wav'
+        validFileTypes = ['raw', 'ascii', 'wav']
         if self.fType not in validFileTypes:
             warnings.warn('Unknown file type, using raw')
             self.fType = 'raw'
         
-        if self.fType == 'raw':
-            # will also sort out the bitdepth
-            self._setEncoding(str(kwargs['encoding']))
-            self._openRaw(kwargs['endian'])
-        elif self.fType == 'ascii':
-            self.encoding = 'ascii'
-            self._openAscii()
+        with instrument.stage('read'):
+            if self.fType == 'raw':
+                # will also sort out the bitdepth
+                self._setEncoding(str(kwargs['encoding']))
+                self._openRaw(kwargs['endian'], kwargs['mmap'])
+            elif self.fType == 'ascii':
+                self.encoding = 'ascii'
+                self._openAscii(kwargs['sidecar'], kwargs['mmap'])
+            elif self.fType == 'wav':
+                # rate, encoding and bitdepth come from the header
+                self._openWav(kwargs['mmap'])
+            if self.read and not isinstance(self.data, np.memmap):
+                instrument.allocated(self.data.nbytes)
         
         
         if self.read:
-            self.length = self.data.size / self.rate 
+            self.length = self.data.shape[0] / self.rate 
             return True
         else:
             return False        
@@ -217,14 +290,17 @@ class AudioFile:
         an existing framed version if no frame shift is specified
         and it was framed previously. Will also not recalculate
         if was already framed with the same frame shift and length.
-        Each row in the return matrix is one frame. The frames may 
-        overlap
+        Each row in the return matrix is one frame, multi-channel 
+        data is (channels, frames, framewidth). The frames may 
+        overlap, they are a read only view (see algorithms.frame) 
+        so copy them before modifying
         
         Parameters
         ----------
-        frameshift: float (sec), optional
+        frameshift: float (sec) or Config.FrameConfig, optional
           Frame shift, if not specified will reuse the current value
-          or default to 0.005 seconds
+          or default to 0.005 seconds. A FrameConfig gives all of the 
+          settings at once
         framewidth: float (sec), optional
           Length of each frame, if not specified will reuse the current value
           or default to 0.020 seconds
@@ -241,154 +317,42 @@ class AudioFile:
         Raises
         ------
         KeyError: unknown key in kwargs
+        ValueError: if the frame shift or width are not positive
         """  
             
-        defaults = {'frameshift':frameshift, 'framewidth':framewidth, 'pad':pad, 'centred':centred, 'centered':centred}    
-        for key in kwargs:
-          if key not in defaults.keys():
-            raise KeyError('Unknown key in AudioFile.frame: ' + str(key))
-        for key in defaults:
-          if key not in kwargs.keys():
-            kwargs[key] = defaults[key]
-        frameshift  = kwargs['frameshift']
-        framelength = kwargs['framewidth'] 
-        pad = kwargs['pad']
-        centred = kwargs['centred'] or kwargs['centered']
-        
-        
-        if (self._framedData is not None) and (frameshift is None and framelength is None) and \
-           not(self.frameshift is None and self.framewidth is None):
-          # Existing version available and frameshift and framelength not specified  
-          return self._framedData
-        elif (self._framedData is not None) and (frameshift == self.frameshift and framewidth == self.framewidth) and \
-             (pad == self._framedPadded or pad is None) and \
-             (not self._framedPadded  or (centred == self._framedCentred or centred is None)) and \
-             not(self.frameshift is None and self.framewidth is None):
-          # Existing version available and frameshift and framelength match that version
-          return self._framedData  
+        if isinstance(frameshift, Config.FrameConfig):
+          config = frameshift
         else:
-          if frameshift is None:
-            if self.frameshift is None:
-              self.frameshift = 0.005
-          else:
-            self.frameshift = float(frameshift)
-          
-          if framewidth is None:
-            if self.framewidth is None:
-              self.framewidth = 0.025
-          else:
-            self.framewidth = float(framewidth)
-        
-          if pad is None:
-            if self._framedPadded is None:
-              self._framedPadded = True
-          else:
-            self._framedPadded = not pad == False
-    
+          for key in kwargs:
+            if key != 'centered':
+              raise KeyError('Unknown key in AudioFile.frame: ' + str(key))
           if centred is None:
-            if self._framedCentred is None:
-              self._framedCentred = True
-          else:
-            self._framedCentred = not centred == False    
-        
-          
-          # convert to points from seconds
-          self._frameshiftPT = int(self.frameshift * self.rate)
-          if not (self.frameshift * self.rate).is_integer():
-            warnings.warn('frame shift is not an integer frame shift in data points')
-          
-          self._framewidthPT = int(self.framewidth * self.rate)
-          if not (self.framewidth * self.rate).is_integer():
-            warnings.warn('frame width is not an integer frame shift in data points')
+            centred = kwargs.get('centered')
+          config = self._frameConfigFrom(frameshift, framewidth, pad, centred)
         
-    
-          
-          if self._framedPadded:
-            startInds = range(0, self.data.size, self._frameshiftPT)  
-            self._framedData = np.zeros((len(startInds), self._framewidthPT))  
-            
-            if self._framedCentred:
-              halfwidth = self._framewidthPT/2
-              maxS = self.data.size - halfwidth; minS = halfwidth
-              for i, s in enumerate(startInds):
-                if s > minS and s < maxS:  
-                  self._framedData[i,:] = self.data[s-halfwidth:s+halfwidth,:].T
-                else:
-                  if s < self._framewidthPT:  
-                    appendFrame = self.data[0:s+halfwidth,:].T 
-                    self._framedData[i, -appendFrame.size:] = appendFrame
-                  else:
-                    appendFrame = self.data[s-halfwidth:,:].T  
-                    self._framedData[i, :appendFrame.size] = appendFrame
-            else:
-              for i, s in enumerate(startInds):
-                appendFrame = self.data[s:s+self._framewidthPT,:].T
-                self._framedData[i, :appendFrame.size] = appendFrame  
-    
-          else:
-            startInds = range(0,(self.data.size-self._framewidthPT), self._frameshiftPT)    
-            self._framedData = np.zeros((len(startInds), self._framewidthPT))  
-            for i, s in enumerate(startInds):
-              self._framedData[i,:] = self.data[s:s+self._framewidthPT,:].T
-    
-          self.parameterised = False          
-    
-          """      
-          # This was used for finding the fastest method to do the framing
-          # If you would like to try something else this is left for comparisons     
-    
-          import time    
-    
-          m = 10
-          print 
-          
-          # pre-allocated numpy array 0.004 sec
-          start = time.clock()
-          for n in range(m):
-              startInds = range(0,(self.data.size-self._framewidthPT), self._frameshiftPT)    
-              self._framedData = np.zeros((len(startInds), self._framewidthPT))  
-              for i, s in enumerate(startInds):
-                self._framedData[i,:] = self.data[s:s+self._framewidthPT,:].T
-          end = time.clock()
-          print 'pre allocated numpy',
-          print (end - start)/m
-          
-          # list comprehension 0.227 sec
-          start = time.clock()
-          for n in range(m):
-              startInds = range(0,(self.data.size-self._framewidthPT), self._frameshiftPT)      
-              self._framedData = [self.data[s:s+self._framewidthPT,:] for s in startInds]
-              self._framedData = np.array(self._framedData).squeeze()
-          end = time.clock()
-          print 'list comprehension ',
-          print (end - start)/m
-          
-          # numpy stacking  0.379 sec
-          start = time.clock()
-          for n in range(m):
-              startInds = range(0,self.data.size-self._framewidthPT, self._frameshiftPT) 
-              self._framedData = self.data[0:self._framewidthPT,:].T
-              for s in startInds[1:]:
-                  self._framedData = np.vstack((self._framnumpy ndarrayedData, self.data[s:s+self._framewidthPT,:].T))
-    
-          end = time.clock()
-          print 'numpy stacking     ',
-          print (end - start)/m
-          
-          # list stacking  0.065 sec    
-          start = time.clock()
-          for n in range(m):
-              startInds = range(0,self.data.size-self._framewidthPT, self._frameshiftPT) 
-              self._framedData = [self.data[0:self._framewidthPT,:].T]
-              for s in startInds[1:]:
-                  self._framedData.append(self.data[s:s+self._framewidthPT,:].T)
-              self._framedData = np.array(self._framedData).squeeze()   
-          end = time.clock()
-          print 'list stacking      ',
-          print (end - start)/m
-          """
-          
+        if self._framedData is not None and config == self._frameConfig:
+          # Existing version available with the same settings
           return self._framedData
+        
+        self._frameConfig = config
+        self.frameshift = config.frameshift
+        self.framewidth = config.framewidth
+        self._framedPadded = config.pad
+        self._framedCentred = config.centred
+        
+        # convert to points from seconds
+        self._frameshiftPT, self._framewidthPT = config.points(self.rate)
+        if not (self.frameshift * self.rate).is_integer():
+          warnings.warn('frame shift is not an integer frame shift in data points')
+        if not (self.framewidth * self.rate).is_integer():
+          warnings.warn('frame width is not an integer frame shift in data points')
+        
+        with instrument.stage('frame'):
+            self._framedData = algorithms.frame(self.data, self._frameshiftPT, self._framewidthPT, 
+                                                self._framedPadded, self._framedCentred, self.dtype)
+        self._emphasisedData = {} # derived from the old frames
+        
+        return self._framedData
             
     def window(self, windowType = None, normalisation = None, kaiserBeta = None, **kwargs):
         """ Creates a windowed version of the framed data 
@@ -397,8 +361,9 @@ class AudioFile:
         the data was not framed it is done so. Several options 
         for window function and normalisation of the window function 
         are provided. The window function creates an array which 
-        is then normalised if appropriate. This array is then elementwise
-        multiplied into the framed data. If the data has already been
+        is then normalised if appropriate (window functions are cached and 
+        shared by all AudioFile objects, see algorithms.window). This array 
+        is then elementwise multiplied into the framed data. If the data has already been
         windowed and no parameters are passed then it will reuse the existing
         windowed data parameters.
         
@@ -406,7 +371,7 @@ class AudioFile:
         ----------
         windowType {'blackman', 'bartlett', 'hamming', 'hanning', 'kaiser', 'rectangular', 'trapazoid'}, optional
           pick the window type. If kaiser is specified then the beta parameter must also be, 
-          default is blackman
+          default is blackman. A Config.WindowConfig gives all of the window settings at once
         normalisation {'none', 'sum', 'square sum'}, optional
           what form of normalisation to use on the window. If 'sum' then the array sums
           to one, if 'square sum', then the elementwise square sums to one, default is 'square sum'
@@ -421,6 +386,8 @@ class AudioFile:
           pad the framed data to the original length
         centred: boolean, optional
           centre the first frame     
+        frameConfig: Config.FrameConfig, optional
+          all of the frame settings at once
         
         Returns
         -------
@@ -429,118 +396,153 @@ class AudioFile:
           
         Raises
         ------
+        KeyError if there is an unknown key in kwargs
         ValueError if window type or normalisation type not recognised
         ValueError if kaiser is specified and no beta is provided
         """  
     
-        defaults = {
-            'windowType':windowType, 
-            'normalisation':normalisation, 'normalization':normalisation,
-            'kaiserBeta':kaiserBeta, 
-            'frameshift':self.frameshift,
-            'framewidth':self.framewidth,
-            'pad':self._framedPadded,
-            'centred':self._framedCentred,  'centered':self._framedCentred }
-        for key in kwargs:
-            if key not in defaults.keys():
-                raise KeyError('Unknown key in AudioFile.window: ' + str(key))
-
-        if 'centered' in kwargs.keys() and 'centred' in kwargs.keys():
-            raise KeyError('"centered" and "centred" cannot both be defined')
-        if 'normalization' in kwargs.keys() and 'normalisation' in kwargs.keys():
-            raise KeyError('"normalisation" and "normalization" cannot both be defined')
-        
-        if 'centered' in kwargs.keys():
-            kwargs['centred'] = kwargs['centered']
-        if 'normalization' in kwargs.keys():
-            kwargs['normalisation'] = kwargs['normalization']
-
-        for key in defaults:
-            if key not in kwargs.keys() + ['centered','normalization']:
-                kwargs[key] = defaults[key]
-        
-        if kwargs['windowType'] is None:
-            if self.windowType is None:
-                windowType = 'blackman'
-            else:
-                windowType = self.windowType
-        else:  
-            windowType = kwargs['windowType'].lower()        
-        if windowType not in ['blackman', 'bartlett', 'hamming', 'hanning', 'kaiser', 'rectangular', 'trapazoid']:
-            raise ValueError('Unknown window function in AudioFile.window()') 
-      
-        if kwargs['normalisation'] is None:
-            if self.windowNorm is None:
-                windowNorm = 'square sum'
-            else:
-                windowNorm = self.windowNorm
+        if isinstance(windowType, Config.WindowConfig):
+            kwargs['windowConfig'] = windowType
         else:
-            windowNorm = kwargs['normalisation'].lower()
-        if windowNorm not in ['none', 'sum', 'square sum']:
-            raise ValueError('Unknown normalisation in AudioFile.window()')   
-    
-        if windowType == 'kaiser':
-            if kwargs['kaiserBeta'] is None:
-                kwargs['kaiserBeta'] = self.kaiserBeta   
-            try:
-                self.kaiserBeta = float(kwargs['kaiserBeta'])
-            except:
-                raise ValueError('float beta value is needed for kaiser windowing')  
+            kwargs['windowType'] = windowType
+            if normalisation is not None or 'normalization' not in kwargs:
+                kwargs['normalisation'] = normalisation
+            kwargs['kaiserBeta'] = kaiserBeta
+        frameConfig, windowConfig = self._configs('window', kwargs)
 
         # if nothing has changed then just return
-        if windowType == self.windowType and windowNorm == self.windowNorm and not self._windowedData is None:
-            if not self._windowFunction is None:
-                if all([self._windowFunction.size == self._framewidthPT,
-                        kwargs['frameshift'] == self.frameshift, 
-                        kwargs['framewidth'] == self.framewidth,
-                        kwargs['pad'] == self._framedPadded, 
-                        kwargs['centred'] == self._framedCentred]):
-                    return self._windowedData
+        key = (frameConfig, windowConfig, self.preemphasised and self.alpha)
+        if self._windowedData is not None and key == self._windowKey:
+            return self._windowedData
     
         # redo the framing       
-        self.frame(kwargs['frameshift'], kwargs['framewidth'], kwargs['pad'], kwargs['centred'])
-    
-        windowSize = self._framewidthPT
-        self.windowType = windowType
-        self.windowNorm = windowNorm
-
-        # get the window    
-        if   self.windowType == 'blackman':    self._windowFunction = np.blackman(windowSize)    
-        elif self.windowType == 'bartlett':    self._windowFunction = np.bartlett(windowSize)      
-        elif self.windowType == 'hamming':     self._windowFunction = np.hamming(windowSize)      
-        elif self.windowType == 'hanning':     self._windowFunction = np.hanning(windowSize)      
-        elif self.windowType == 'kaiser':      self._windowFunction = np.kaiser(windowSize, kaiserBeta)      
-        elif self.windowType == 'rectangular': self._windowFunction = np.ones((windowSize))      
-        elif self.windowType == 'trapazoid':
-            m1 = windowSize / 4   
-            m2 = windowSize * 3 / 4;   
-            slope = 4.0 / (windowSize - 1);   
-            self._windowFunction = np.ones(windowSize)
-            for k in range(m1):
-                self._windowFunction[k] = k * slope  
-            for i, k in enumerate(range(m2, windowSize)):
-                self._windowFunction[k] = 4.0 - i * slope  
-        
-        self._windowFunction = np.array(self._windowFunction, ndmin = 2)    
-
-        # normalise if needed
-        if self.windowNorm == 'none': 
-            pass
-        elif self.windowNorm == 'sum':
-            self._windowFunction = self._windowFunction / np.sum(self._windowFunction)  
-        elif self.windowNorm == 'square sum':
-            self._windowFunction = self._windowFunction / np.sum(np.square(self._windowFunction))
-
-        # window the data
-        self._windowedData = self._framedData * self._windowFunction
+        self.frame(frameConfig)
+    
+        self._windowConfig = windowConfig
+        self.windowType = windowConfig.windowType
+        self.windowNorm = windowConfig.normalisation
+        if windowConfig.kaiserBeta is not None:
+            self.kaiserBeta = windowConfig.kaiserBeta
+
+        # before the window stage, as preemphasis is a stage of its own
+        framed = self._emphasised() if self.preemphasised else self._framedData
+        with instrument.stage('window'):
+            self._windowFunction = windowConfig.function(self._framewidthPT, float if self.dtype is None else self.dtype)
+
+            # window the data
+            self._windowedData = framed * self._windowFunction
+            instrument.allocated(self._windowedData.nbytes)
+        self._windowKey = key
         
         return self._windowedData
 
+    def iterFrames(self, blockFrames = 1000, **kwargs):
+        """ Iterates over the framed and windowed data in blocks
+        
+        Works through the file a block of frames at a time, only reading the 
+        part of the data each block covers (with the overlap between frames 
+        carried across block boundaries), so that arbitrarily long files can 
+        be processed in constant memory. Nothing is stored on the object, 
+        unspecified parameters reuse the current values or the defaults of 
+        frame and window. The blocks are identical to the corresponding rows 
+        of frame() and window() with the same parameters, so the windowed
+        frames are pre-emphasised with alpha if the data has been.
+        
+        Parameters
+        ----------
+        blockFrames: int, optional
+          number of frames in each block (the last block may be shorter), default 1000
+        
+        Keyword arguments
+        -----------------
+        frameshift: float, optional
+          frame shift in seconds
+        framewidth: float, optional
+          frame width in seconds
+        pad: boolean, optional
+          pad the framed data to the original length
+        centred: boolean, optional
+          centre the first frame     
+        windowType: string, optional
+          window type, see window
+        normalisation: string, optional
+          window normalisation, see window
+        kaiserBeta: float, optional
+          beta for kaiser windows
+        frameConfig: Config.FrameConfig, optional
+          all of the frame settings at once, instead of frameshift, framewidth, pad and centred
+        windowConfig: Config.WindowConfig, optional
+          all of the window settings at once, instead of windowType, normalisation and kaiserBeta
+        
+        Yields
+        ------
+        (numpy ndarray, numpy ndarray)
+          framed and (pre-emphasised and) windowed versions of the next block of frames
+          
+        Raises
+        ------
+        KeyError: unknown key in kwargs
+        ValueError: if blockFrames is not positive or the window is not recognised
+        """
+        blockFrames = int(blockFrames)
+        if blockFrames < 1:
+            raise ValueError('AudioFile.iterFrames needs at least one frame per block')
+        frameshiftPT, framewidthPT, pad, centred, windowFunction = self._frameSettings('iterFrames', kwargs)
+        
+        numFrames = algorithms.frameCount(self.data.shape[0], frameshiftPT, framewidthPT, pad)
+        for first in range(0, numFrames, blockFrames):
+            framed = algorithms.frameRange(self.data, frameshiftPT, framewidthPT, first, blockFrames, pad, centred, self.dtype)
+            yield framed, (self._emphasise(framed) if self.preemphasised else framed) * windowFunction
+
+    def windowFrames(self, alpha = None, out = None, dtype = None, **kwargs):
+        """ Frames, pre-emphasises and windows the data in a single stage
+        
+        Gives the same result as frame, preemphasise and window but goes 
+        straight from the signal to the windowed frames without storing 
+        anything on the object (see algorithms.windowedFrames). Unspecified 
+        parameters reuse the current values or the defaults of frame and window.
+        
+        Parameters
+        ----------
+        alpha: float, optional
+          preemphasis constant, default None for no preemphasis
+        out: numpy ndarray, optional
+          array of the right shape to write the windowed frames into
+        dtype: numpy dtype, optional
+          type of the result if out is not given, default the file's dtype if it has one
+          (as for window), otherwise float64
+        
+        Keyword arguments
+        -----------------
+        frameshift, framewidth, pad, centred, windowType, normalisation, kaiserBeta
+          as for iterFrames
+        
+        Returns
+        -------
+        numpy ndarray
+          preemphasised and windowed frames
+          
+        Raises
+        ------
+        KeyError: unknown key in kwargs
+        ValueError: if the window is not recognised or out is the wrong shape
+        """
+        with instrument.stage('windowFrames'):
+            frameshiftPT, framewidthPT, pad, centred, windowFunction = self._frameSettings('windowFrames', kwargs)
+            if dtype is None:
+                dtype = self.dtype
+            return algorithms.windowedFrames(self.data, frameshiftPT, framewidthPT, windowFunction, alpha, pad, centred, 
+                                             out, dtype)
+
     def preemphasise(self, alpha = None, **kwargs):
         """ Applies the preemphasis transform
     
         the preemphasis transform is for frame s_i
         s_i(n) = s_i(n) - alpha * s_i(n-1)
+        
+        The framed data is left as it is, the preemphasised frames are
+        kept alongside it (once for each alpha) until the data is reframed,
+        and are used by window until unemphasise is called
     
         Parameters
         ----------
@@ -550,37 +552,31 @@ class AudioFile:
         Returns
         -------
         numpy ndarray 
-          The preemphasised data
+          The preemphasised data, read only as it is shared
         """
 
-        defaults = {'alpha':alpha}
         for key in kwargs:
-            if key not in defaults.keys():
-                raise KeyError('Unknown key in Audiofile.preemphasise: {0}'.format(key))
-        for key in defaults:
-            if key not in kwargs.keys():
-                kwargs[key] = defaults[key] 
+            raise KeyError('Unknown key in Audiofile.preemphasise: {0}'.format(key))
     
-        if kwargs['alpha'] is None:
+        if alpha is None:
             if self.alpha is None: 
                 alpha = 0.97 
             else:
                 alpha = self.alpha
         else:
-            alpha = float(kwargs['alpha'])
+            alpha = float(alpha)
 
-        if self.preemphasised and self.alpha == alpha:
-            return self._framedData
-        else:
-            self.frame()
-            self._framedData[:,1:] -= alpha*self._framedData[:,1:]
-            self.parameterised = True
+        if not (self.preemphasised and self.alpha == alpha):
+            self.preemphasised = True
             self.alpha = alpha
             self._windowedData = None
-            return self._framedData         
+        return self._emphasised()
        
     def unemphasise(self):
         """ Reverts the data to before the preemphaisis 
+        
+        The framed data was never changed so this only stops window using
+        the preemphasised frames
     
         Returns
         -------
@@ -588,14 +584,77 @@ class AudioFile:
           umemphasised framed data
         """
         if self.preemphasised:
-            self._framedData = None
-            return self.frame()
-        else:  
-            return self._framedData
+            self.preemphasised = False
+            self._windowedData = None
+        return self.frame()
+
+    def resample(self, targetRate, blockSamples = 1 << 20):
+        """ Resamples the data to a new sampling rate
+
+        Uses rational ratio polyphase resampling (see algorithms.resample),
+        working through the data a block at a time so a memory mapped file
+        is never read in full. The filter for each ratio is designed once
+        and shared. The data and rate are replaced, the frame, window and
+        preemphasis settings (in seconds) are kept and everything derived
+        from the old data is recalculated when it is next asked for. The
+        encoding and bitdepth then describe the new float data
+
+        Parameters
+        ----------
+        targetRate: float
+          new sampling rate in Hz
+        blockSamples: int, optional
+          samples of the old data processed at a time, default 2**20
+
+        Returns
+        -------
+        numpy ndarray
+          the resampled data, (samples, channels) in dtype (default float64)
+
+        Raises
+        ------
+        IOError: if no file has been read
+        ValueError: if the rate is not positive or the ratio to the current rate is too complex
+        """
+        if not self.read:
+            raise IOError('AudioFile.resample needs a file to be read')
+        targetRate = float(targetRate)
+        if targetRate == self.rate:
+            return self.data
+        with instrument.stage('resample'):
+            self.data = algorithms.resample(self.data, self.rate, targetRate, blockSamples, self.dtype)
+        self.rate = targetRate
+        self.encoding = 'float'
+        self.bitdepth = self.data.dtype.itemsize * 8
+        self._dataVersion = next(_dataVersions)
+        self.length = self.data.shape[0] / self.rate
+        self._framedData = None
+        self._windowedData = None
+        self._windowKey = None
+        self._emphasisedData = {}
+        return self.data
+
 
-    
     ############### PRIVATE METHODS ###############
     
+    def _emphasised(self):
+        """ The preemphasised frames for the current alpha, made from the framed data the first time """
+        framed = self.frame()
+        if self.alpha not in self._emphasisedData:
+            with instrument.stage('preemphasise'):
+                emphasised = self._emphasise(framed)
+                emphasised.flags.writeable = False
+            self._emphasisedData[self.alpha] = emphasised
+        return self._emphasisedData[self.alpha]
+
+    def _emphasise(self, framed):
+        """ A preemphasised copy of the frames with the current alpha, each frame on its own """
+        # the frames are a read only view so work on a copy
+        emphasised = np.array(framed, dtype = float if self.dtype is None else self.dtype)
+        emphasised[...,1:] -= self.alpha*emphasised[...,:-1]
+        instrument.allocated(emphasised.nbytes)
+        return emphasised
+    
     def _setEncoding(self,encoding):
         """ Sets the encoding for the file """
         if encoding is None:
@@ -621,8 +680,60 @@ class AudioFile:
             warnings.warn('Unknown encoding, using float')
             self.encoding = 'float'
       
-    def _openRaw(self, endian):
-        """ Opens raw files """  
+    def _frameSettings(self, caller, kwargs):
+        """ Frame and window settings from kwargs, the current values or the defaults, nothing is stored """
+        frameConfig, windowConfig = self._configs(caller, kwargs)
+        frameshiftPT, framewidthPT = frameConfig.points(self.rate)
+        windowFunction = windowConfig.function(framewidthPT, float if self.dtype is None else self.dtype)
+        return frameshiftPT, framewidthPT, frameConfig.pad, frameConfig.centred, windowFunction
+    
+    _settingKeys = ['frameshift', 'framewidth', 'pad', 'centred', 'centered', 'windowType', 
+                    'normalisation', 'normalization', 'kaiserBeta', 'frameConfig', 'windowConfig']
+    
+    def _configs(self, caller, kwargs):
+        """ FrameConfig and WindowConfig from kwargs, the current values or the defaults """
+        for key in kwargs:
+            if key not in self._settingKeys:
+                raise KeyError('Unknown key in AudioFile.{0}: {1}'.format(caller, key))
+        if 'centered' in kwargs and 'centred' in kwargs:
+            raise KeyError('"centered" and "centred" cannot both be defined')
+        if 'normalization' in kwargs and 'normalisation' in kwargs:
+            raise KeyError('"normalisation" and "normalization" cannot both be defined')
+        
+        frameConfig = kwargs.get('frameConfig')
+        if frameConfig is None:
+            frameConfig = self._frameConfigFrom(kwargs.get('frameshift'), kwargs.get('framewidth'), kwargs.get('pad'),
+                                                kwargs.get('centred', kwargs.get('centered')))
+        windowConfig = kwargs.get('windowConfig')
+        if windowConfig is None:
+            windowConfig = self._windowConfigFrom(kwargs.get('windowType'), 
+                                                  kwargs.get('normalisation', kwargs.get('normalization')), 
+                                                  kwargs.get('kaiserBeta'))
+        return frameConfig, windowConfig
+    
+    def _frameConfigFrom(self, frameshift, framewidth, pad, centred):
+        """ FrameConfig from the given values, or the current values or defaults where they are None """
+        current = self._frameConfig or _defaultFrameConfig
+        if (frameshift is None or frameshift == current.frameshift) and \
+           (framewidth is None or framewidth == current.framewidth) and \
+           (pad is None or (not pad == False) == current.pad) and \
+           (centred is None or (not centred == False) == current.centred):
+            return current
+        return current.replace(frameshift = frameshift, framewidth = framewidth, pad = pad, centred = centred)
+    
+    def _windowConfigFrom(self, windowType, normalisation, kaiserBeta):
+        """ WindowConfig from the given values, or the current values or defaults where they are None """
+        current = self._windowConfig or _defaultWindowConfig
+        if (windowType is None or windowType == current.windowType) and \
+           (normalisation is None or normalisation == current.normalisation) and \
+           (kaiserBeta is None or kaiserBeta == current.kaiserBeta):
+            return current
+        return Config.WindowConfig(current.windowType if windowType is None else windowType,
+                                   current.normalisation if normalisation is None else normalisation,
+                                   self.kaiserBeta if kaiserBeta is None else kaiserBeta)
+      
+    def _openRaw(self, endian, mmap = False):
+        """ Opens raw files, memory mapping them if requested """  
         try:
             dtypeStr = ''
             if not endian == '=':
@@ -639,22 +750,248 @@ class AudioFile:
             else:
                 raise ValueError('Unknown encoding')
             dtypeStr += str(self.bitdepth/8)
+            dtype = np.dtype(dtypeStr)
           
-            self.data = np.array(np.fromfile(self.fileID, dtype=np.dtype(dtypeStr), count=-1, sep=''), ndmin=2).T
-            self.length = float(self.data.size) / self.rate
+            # read from the current position for file objects, like fromfile
+            try:
+                offset = self.fileID.tell()
+            except AttributeError:
+                offset = 0
+            data = self._readSamples(dtype, offset, None, mmap)
+            # deinterleave into a (samples, channels) view rather than a copy, dropping any partial sample
+            data = data[:data.size - data.size % self.channels]
+            self.data = data.reshape((-1, self.channels))
+            self.length = float(self.data.shape[0]) / self.rate
             self.read = True
             return True
         except Exception as e:
             self.read = False
             raise e
 
-    def _openAscii(self):
-        """ Opens ASCII files """  
+    def _openWav(self, mmap = False):
+        """ Opens WAV files (PCM 8/16/24/32 bit, IEEE float and WAVE_FORMAT_EXTENSIBLE) """
         try:
-            self.data = np.loadtxt(self.fileID)
-            self.data = np.array(self.data, ndmin = 2)
-            if self.data.shape[0] == 1: 
-                self.data = self.data.T
+            if hasattr(self.fileID, 'read'):
+                fid = self.fileID
+                start = fid.tell()
+            else:
+                fid = open(self.fileID, 'rb')
+                start = 0
+            try:
+                riff, _, wave = struct.unpack('<4sI4s', fid.read(12))
+                if riff != b'RIFF' or wave != b'WAVE':
+                    raise ValueError('Not a RIFF WAVE file')
+                    
+                fmt = None
+                while True:
+                    header = fid.read(8)
+                    if len(header) < 8:
+                        raise ValueError('No data chunk in WAV file')
+                    chunkID, chunkSize = struct.unpack('<4sI', header)
+                    if chunkID == b'fmt ':
+                        fmt = fid.read(chunkSize)
+                        if chunkSize % 2: fid.seek(1, 1)
+                    elif chunkID == b'data':
+                        offset = fid.tell() - start
+                        break
+                    else:
+                        fid.seek(chunkSize + chunkSize % 2, 1) # chunks are word aligned
+            finally:
+                if fid is not self.fileID:
+                    fid.close()
+            if fmt is None:
+                raise ValueError('No fmt chunk before the data in WAV file')
+                
+            formatTag, channels, rate, _, blockAlign, bitdepth = struct.unpack('<HHIIHH', fmt[:16])
+            if formatTag == 0xFFFE and len(fmt) >= 26:
+                # WAVE_FORMAT_EXTENSIBLE, the format is the start of the sub format GUID
+                formatTag = struct.unpack('<H', fmt[24:26])[0]
+
+            if formatTag == 1 and bitdepth == 8:
+                self.encoding = 'unsigned'
+            elif formatTag == 1 and bitdepth in [16, 24, 32]:
+                self.encoding = 'integer'
+            elif formatTag == 3 and bitdepth in [32, 64]:
+                self.encoding = 'float'
+            else:
+                raise ValueError('Unsupported WAV format {0} with {1} bits'.format(formatTag, bitdepth))
+            if channels < 1:
+                raise ValueError('WAV file has no channels')
+            self.rate = float(rate)
+            self.bitdepth = bitdepth
+            self.channels = channels
+            
+            # a data size of zero or 0xFFFFFFFF (streamed files) means up to the end of the file
+            count = (chunkSize // blockAlign) * channels
+            if chunkSize in [0, 0xFFFFFFFF]:
+                count = None
+            
+            if bitdepth == 24:
+                # no 24 bit dtype, sign extend the little endian triplets into 32 bit
+                packed = self._readSamples(np.dtype(('u1', 3)), start + offset, count, mmap)
+                data = np.zeros((packed.shape[0], 4), dtype = np.uint8)
+                data[:, 1:] = packed
+                data = data.view('<i4').ravel() >> 8
+            else:
+                dtype = np.dtype({'u':'<u', 'i':'<i', 'f':'<f'}[self.encoding[0]] + str(bitdepth // 8))
+                data = self._readSamples(dtype, start + offset, count, mmap)
+            
+            # samples are interleaved, drop any partial sample at the end of a streamed file
+            data = data[:data.size - data.size % channels]
+            self.data = data.reshape((-1, channels))
+            self.length = float(self.data.shape[0]) / self.rate
+            self.read = True
+            return True
+        except Exception as e:
+            self.read = False
+            raise e
+
+    def _parseAscii(self):
+        """ Parses the whitespace separated values of an ASCII file a block at a time 
+        
+        Returns the values as a float64 vector and the number of values on the first line,
+        raises ValueError if a line has a different number of values or one is not a number
+        """
+        fid = self.fileID if hasattr(self.fileID, 'read') else open(self.fileID, 'rb')
+        try:
+            blocks = []
+            columns = None
+            tail = b''
+            while True:
+                chunk = fid.read(1 << 24)
+                if not isinstance(chunk, bytes):
+                    chunk = chunk.encode('ascii') # text mode files
+                text = tail + chunk
+                if not text:
+                    break
+                # only parse whole lines so values (and comments) are not split between blocks
+                cut = text.rfind(b'\n') + 1 if chunk else len(text)
+                text, tail = text[:cut], text[cut:]
+                if not text:
+                    continue
+                if b'#' in text:
+                    text = re.sub(b'#[^\n]*', b'', text)
+                start = 0
+                while columns is None and start < len(text):
+                    end = text.find(b'\n', start)
+                    end = len(text) if end < 0 else end
+                    columns = len(text[start:end].split()) or None
+                    start = end + 1
+                if columns is not None and np.any(self._rowLengths(text) != columns):
+                    raise ValueError('Rows of the ASCII file have different numbers of values')
+                # numpy stops quietly (or with a warning) at anything that is not a number
+                if text.translate(None, b'0123456789.eE+-infatyINFATY \t\r\n\x0b\x0c'):
+                    raise ValueError('ASCII file contains a value that is not a number')
+                with warnings.catch_warnings():
+                    warnings.simplefilter('error', DeprecationWarning)
+                    try:
+                        blocks.append(np.fromstring(text, dtype = np.float64, sep = ' '))
+                    except DeprecationWarning:
+                        raise ValueError('ASCII file contains a value that is not a number')
+        finally:
+            if fid is not self.fileID:
+                fid.close()
+        values = np.concatenate(blocks) if blocks else np.zeros(0)
+        return values, columns or 1
+    
+    @staticmethod
+    def _rowLengths(text):
+        """ Number of values on each line of the text that has any, without splitting it into lines """
+        chars = np.frombuffer(text, dtype = np.uint8)
+        space = chars <= ord(' ') # the only control characters allowed are whitespace
+        # a value starts at a non space character that follows a space (or the start)
+        starts = np.flatnonzero(space[:-1] & ~space[1:]) + 1
+        if chars.size and not space[0]:
+            starts = np.concatenate(([0], starts))
+        lines = np.searchsorted(np.flatnonzero(chars == ord('\n')), starts)
+        lengths = np.bincount(lines)
+        return lengths[lengths > 0]
+
+    _sidecarHeader = '<8sqdI4x' # magic, text file size and modification time, columns
+    _sidecarMagic = b'PYSLASC1'
+    
+    def _readSidecar(self, mmap = False):
+        """ The values and columns from the sidecar, (None, 1) if there is none or it is out of date """
+        path = self.name + '.f64'
+        headerSize = struct.calcsize(self._sidecarHeader)
+        try:
+            stat = os.stat(self.name)
+            with open(path, 'rb') as fid:
+                magic, size, mtime, columns = struct.unpack(self._sidecarHeader, fid.read(headerSize))
+            count = (os.path.getsize(path) - headerSize) // 8
+        except (IOError, OSError, struct.error):
+            return None, 1
+        if magic != self._sidecarMagic or size != stat.st_size or mtime != stat.st_mtime:
+            return None, 1
+        if count == 0:
+            return np.zeros(0), columns
+        if mmap:
+            return np.memmap(path, dtype = '<f8', mode = 'r', offset = headerSize, shape = (count,)), columns
+        with open(path, 'rb') as fid:
+            fid.seek(headerSize)
+            return np.fromfile(fid, dtype = '<f8', count = count), columns
+    
+    def _writeSidecar(self, values, columns):
+        """ Writes the sidecar, atomically so that other readers never see part of one """
+        stat = os.stat(self.name)
+        path = self.name + '.f64'
+        temp = '{0}.{1}.tmp'.format(path, os.getpid())
+        try:
+            with open(temp, 'wb') as fid:
+                fid.write(struct.pack(self._sidecarHeader, self._sidecarMagic, stat.st_size, stat.st_mtime, columns))
+                values.astype('<f8', copy = False).tofile(fid)
+            if os.path.exists(path) and os.name == 'nt':
+                os.remove(path) # rename does not replace on windows
+            os.rename(temp, path)
+        except (IOError, OSError) as e:
+            warnings.warn('Could not write the ASCII sidecar {0}: {1}'.format(path, e))
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def _readSamples(self, dtype, offset, count = None, mmap = False):
+        """ Reads (or memory maps) count samples from offset bytes into the file, by default up to the end """
+        try:
+            nBytes = os.fstat(self.fileID.fileno()).st_size - offset
+        except AttributeError:
+            nBytes = os.path.getsize(self.fileID) - offset
+        available = max(0, nBytes // dtype.itemsize)
+        count = available if count is None else min(int(count), available)
+        
+        if count == 0:
+            return np.zeros(0, dtype=dtype) # empty files can not be mapped
+        if mmap:
+            return np.memmap(self.fileID, dtype=dtype, mode='r', offset=offset, shape=(count,))
+        if hasattr(self.fileID, 'seek'):
+            self.fileID.seek(offset)
+            return np.fromfile(self.fileID, dtype=dtype, count=count, sep='')
+        with open(self.fileID, 'rb') as fid:
+            fid.seek(offset)
+            return np.fromfile(fid, dtype=dtype, count=count, sep='')
+
+    def _openAscii(self, sidecar = False, mmap = False):
+        """ Opens ASCII files, through the binary sidecar if asked for """  
+        try:
+            # sidecars only for files given by name
+            sidecar = sidecar and not hasattr(self.fileID, 'read')
+            values = None
+            if sidecar:
+                values, columns = self._readSidecar(mmap)
+            if values is None:
+                values, columns = self._parseAscii()
+                if sidecar:
+                    self._writeSidecar(values, columns)
+            
+            if self.channels > 1:
+                # one sample per row or interleaved, either way the values are in order
+                self.data = values[:values.size - values.size % self.channels].reshape((-1, self.channels))
+            elif columns > 1 and values.size > columns:
+                if values.size % columns:
+                    raise ValueError('Rows of the ASCII file have different numbers of values')
+                self.data = values.reshape((-1, columns))
+            else:
+                # a single column, or a single row which is taken as a column
+                self.data = values.reshape((-1, 1))
+            self.channels = self.data.shape[1] # columns of a multi column file are channels
             self.bitDepth = None
             self.read = True
             return True
@@ -703,22 +1040,5 @@ if __name__ == '__main__':
     print '   unemphasising data ...',
     afRaw.unemphasise()
     print ' done'
-
-    import time    
-    afTest = AudioFile()
-    testFile = os.path.join('..','demo','test.raw')
-    
-    start = time.clock()
-    m = 10
-    for n in range(m):
-        afTest.clear()
-        afTest.open(testFile)
-        afTest.frame()
-        afTest.window()
-    end = time.clock()
-    print "   average run time for frame and window: {0}".format((end-start)/m)
-    
-
-
-
-
+    print '   (see benchmarks/benchmark.py for timings)'
+    print 'Done'
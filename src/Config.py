@@ -0,0 +1,207 @@
+# Contains the settings objects for framing, windowing and MFCCs
+
+import algorithms
+
+
+class _Config(object):
+    """
+    Frozen settings
+
+    Settings are checked once when they are made and can not be changed
+    afterwards, so two settings objects with the same values are equal and
+    hash the same. They can be compared to see if a stored result is still
+    valid and used as (part of) a key to share results between objects.
+
+    Methods
+    -------
+        replace: Returns a copy with some of the values changed
+        key:     Returns the values as a tuple
+    """
+    __slots__ = ()
+    fields = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError('{0} can not be changed, use replace'.format(type(self).__name__))
+
+    def _set(self, **values):
+        """ Sets the values from the constructor """
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def key(self):
+        """ Returns the values as a tuple, in the order of fields """
+        return tuple(getattr(self, name) for name in self.fields)
+
+    def replace(self, **changes):
+        """ Returns a copy with the given values changed, None keeps the current value
+
+        Raises
+        ------
+        KeyError: if a value is not one of the fields
+        """
+        values = dict(zip(self.fields, self.key()))
+        for name, value in changes.items():
+            if name not in values:
+                raise KeyError('Unknown key in {0}.replace: {1}'.format(type(self).__name__, name))
+            if value is not None:
+                values[name] = value
+        return type(self)(**values)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.key() == other.key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((type(self).__name__,) + self.key())
+
+    def __reduce__(self):
+        return (type(self), self.key())
+
+    def __repr__(self):
+        return '{0}({1})'.format(type(self).__name__,
+                                 ', '.join('{0}={1!r}'.format(name, getattr(self, name)) for name in self.fields))
+
+
+class FrameConfig(_Config):
+    """
+    Frame settings, see AudioFile.frame
+
+    Attributes
+    ----------
+        frameshift: Shift between frames in seconds
+        framewidth: Length of each frame in seconds
+        pad:        Zero pad so there is a frame for every frame shift
+        centred:    First sample is in the centre of the first frame (only relevant for padding)
+
+    Methods
+    -------
+        points: Returns the frame shift and width in data points
+    """
+    __slots__ = ('frameshift', 'framewidth', 'pad', 'centred')
+    fields = __slots__
+
+    def __init__(self, frameshift = 0.005, framewidth = 0.025, pad = True, centred = True):
+        """ Constructor
+
+        Raises
+        ------
+        ValueError: if the frame shift or width are not positive
+        """
+        frameshift = float(frameshift)
+        framewidth = float(framewidth)
+        if frameshift <= 0 or framewidth <= 0:
+            raise ValueError('frame shift and width must be positive')
+        self._set(frameshift = frameshift, framewidth = framewidth, pad = not pad == False, centred = not centred == False)
+
+    def points(self, rate):
+        """ Returns (frame shift, frame width) in data points at the given rate """
+        return int(self.frameshift * rate), int(self.framewidth * rate)
+
+
+class WindowConfig(_Config):
+    """
+    Window settings, see AudioFile.window
+
+    Attributes
+    ----------
+        windowType:    Type of window, one of algorithms.windowTypes
+        normalisation: Normalisation of the window, one of algorithms.normalisations
+        kaiserBeta:    Beta of kaiser windows, None for other windows
+
+    Methods
+    -------
+        function: Returns the window function
+    """
+    __slots__ = ('windowType', 'normalisation', 'kaiserBeta')
+    fields = __slots__
+
+    def __init__(self, windowType = 'blackman', normalisation = 'square sum', kaiserBeta = None):
+        """ Constructor
+
+        Raises
+        ------
+        ValueError: if the window type or normalisation is not recognised, or a kaiser window has no beta
+        """
+        windowType = str(windowType).lower()
+        normalisation = str(normalisation).lower()
+        if windowType not in algorithms.windowTypes:
+            raise ValueError('Unknown window function: {0}'.format(windowType))
+        if normalisation not in algorithms.normalisations:
+            raise ValueError('Unknown normalisation: {0}'.format(normalisation))
+        if windowType == 'kaiser':
+            try:
+                kaiserBeta = float(kaiserBeta)
+            except (TypeError, ValueError):
+                raise ValueError('float beta value is needed for kaiser windowing')
+        else:
+            kaiserBeta = None # does not change the window
+        self._set(windowType = windowType, normalisation = normalisation, kaiserBeta = kaiserBeta)
+
+    def function(self, size, dtype = float):
+        """ Returns the (shared, read only) window function of size points, see algorithms.window """
+        return algorithms.window(self.windowType, size, self.normalisation, self.kaiserBeta, dtype)
+
+
+class MfccConfig(_Config):
+    """
+    MFCC settings, see SpeechFeatures.mfcc
+
+    Attributes
+    ----------
+        order:    Number of MFCCs
+        fftLen:   Length of the FFT, None for the frame width
+        lowBand:  Lowest band for the mel filters in Hz
+        highBand: Highest band for the mel filters in Hz, None for half the sampling rate
+
+    Methods
+    -------
+        bands: Returns the low and high bands for a sampling rate
+    """
+    __slots__ = ('order', 'fftLen', 'lowBand', 'highBand')
+    fields = __slots__
+
+    def __init__(self, order = 60, fftLen = None, lowBand = 0, highBand = None):
+        """ Constructor
+
+        Raises
+        ------
+        ValueError: if the order or FFT length are not positive or the bands are negative
+        """
+        order = int(order)
+        if order < 1:
+            raise ValueError('MFCC order must be positive')
+        if fftLen is not None:
+            if not float(fftLen).is_integer() or int(fftLen) < 1:
+                raise ValueError('FFT Length is not a positive integer')
+            fftLen = int(fftLen)
+        lowBand = float(lowBand)
+        highBand = None if highBand is None else float(highBand)
+        if lowBand < 0 or (highBand is not None and highBand <= lowBand):
+            raise ValueError('mel filter bands must be positive with the high band above the low band')
+        self._set(order = order, fftLen = fftLen, lowBand = lowBand, highBand = highBand)
+
+    def bands(self, rate):
+        """ Returns (low band, high band) in Hz for audio at the given sampling rate """
+        return self.lowBand, float(rate) / 2 if self.highBand is None else self.highBand
+
+
+if __name__ == '__main__':
+    print "Testing Config module"
+
+    import pickle
+
+    print "   comparing and hashing ...",
+    assert FrameConfig(0.01, 0.02) == FrameConfig(0.01, 0.02, True, True)
+    assert hash(WindowConfig('Hamming')) == hash(WindowConfig('hamming', kaiserBeta = 8))
+    assert MfccConfig(13).replace(lowBand = 300) != MfccConfig(13)
+    assert pickle.loads(pickle.dumps(MfccConfig(13), 2)) == MfccConfig(13)
+    try:
+        FrameConfig().pad = False
+        raise AssertionError('FrameConfig was changed')
+    except AttributeError:
+        pass
+    print " done"
+
+    print "Done"
@@ -0,0 +1,248 @@
+# Contains the on disk cache of extracted features
+
+import errno
+import hashlib
+import numpy as np
+import os
+import tempfile
+
+
+class FeatureCache(object):
+    """
+    Persistent feature cache
+
+    Features are stored as .npy files named by a hash of everything that
+    affects them (see key), so the same audio with the same settings is only
+    ever extracted once and later extractions are just a file open. Stored
+    arrays are returned memory mapped and read only.
+
+    Any number of processes can share a directory: each array is written to a
+    temporary file and renamed into place, so readers never see a partial
+    file and two writers of the same key write the same content. When the
+    total size goes over maxBytes the least recently used files are removed,
+    down to evictTo of maxBytes so that the directory is not scanned on every
+    put. The total is kept as a running estimate, recounted from the
+    directory when it goes over maxBytes and every rescanPuts puts so the
+    arrays other processes store are noticed.
+
+    Methods
+    -------
+        key:      Returns the key for a set of parameters
+        get:      Returns the stored array for a key or None
+        put:      Stores an array under a key
+        size:     Returns the total size of the stored arrays in bytes
+        clear:    Removes every stored array
+
+    Attributes
+    ----------
+        directory: Where the arrays are stored
+        maxBytes:  Size the cache is kept under, None for no limit
+        hits:      Number of gets that found an array (in this process)
+        misses:    Number of gets that did not
+        evictTo:   Fraction of maxBytes eviction goes down to
+        rescanPuts: Puts between recounting the total size from the directory
+
+    Private methods and attributes
+    ------------------------------
+        _path(key):  File an array is stored in
+        _entries():  (path, size, last used) of each stored array
+        _evict():    Removes the least recently used files until under evictTo of maxBytes
+        _size:       Estimated total size of the stored arrays, None until counted
+        _puts:       Puts since the total was last counted
+    """
+
+    suffix = '.npy'
+    evictTo = 0.9     # fraction of maxBytes eviction goes down to
+    rescanPuts = 1000 # puts between recounting the total from the directory
+
+    def __init__(self, directory, maxBytes = 2**30):
+        """ Constructor
+
+        Parameters
+        ----------
+        directory: string
+            directory to keep the arrays in, created if needed
+        maxBytes: int, optional
+            size to keep the cache under, default 1GB, None for no limit
+        """
+        self.directory = os.path.abspath(directory)
+        self.maxBytes = None if maxBytes is None else int(maxBytes)
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._puts = 0
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    @staticmethod
+    def key(*parts):
+        """ Returns a key made from a hash of the parts
+
+        Parameters
+        ----------
+        parts:
+            anything whose repr identifies it, e.g. strings, numbers, None and tuples
+
+        Returns
+        -------
+        string
+            hexadecimal key
+        """
+        return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """ Returns the array stored under key
+
+        Parameters
+        ----------
+        key: string
+            key from FeatureCache.key
+
+        Returns
+        -------
+        numpy ndarray or None
+            the read only memory mapped array, None if it is not stored
+        """
+        path = self._path(key)
+        try:
+            array = np.load(path, mmap_mode = 'r')
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path, None) # marks it as recently used
+        except OSError:
+            pass # read only or shared with another user, it is still a hit
+        self.hits += 1
+        return array
+
+    def put(self, key, array):
+        """ Stores an array under key
+
+        Parameters
+        ----------
+        key: string
+            key from FeatureCache.key
+        array: numpy ndarray
+            the array to store
+        """
+        fd, temp = tempfile.mkstemp(suffix = '.tmp', dir = self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.asarray(array))
+                added = f.tell()
+            try:
+                added -= os.path.getsize(self._path(key)) # replaced
+            except OSError:
+                pass
+            try:
+                os.rename(temp, self._path(key))
+            except OSError:
+                # (windows) another writer stored it first, the content is the same
+                if not os.path.exists(self._path(key)):
+                    raise
+                os.remove(temp)
+        except:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        if self.maxBytes is None:
+            return
+        self._puts += 1
+        if self._size is None or self._puts >= self.rescanPuts:
+            self._size = self.size()
+            self._puts = 0
+        else:
+            self._size += added
+        if self._size > self.maxBytes:
+            self._evict()
+
+    def size(self):
+        """ Returns the total size of the stored arrays in bytes """
+        return sum(size for _, size, _ in self._entries())
+
+    def clear(self):
+        """ Removes every stored array """
+        for path, _, _ in self._entries():
+            _remove(path)
+        self._size = 0
+
+    def _path(self, key):
+        """ File an array is stored in """
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _entries(self):
+        """ (path, size, last used) of each stored array """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue # removed by another process
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict(self):
+        """ Removes the least recently used files until the cache is under evictTo of maxBytes """
+        entries = sorted(self._entries(), key = lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        if total > self.maxBytes:
+            for path, size, _ in entries:
+                if total <= self.maxBytes * self.evictTo:
+                    break
+                _remove(path)
+                total -= size
+        self._size = total
+        self._puts = 0
+
+
+def _remove(path):
+    """ Removes a file that another process may have removed (or still have open) """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+if __name__ == '__main__':
+    print "Testing FeatureCache module"
+
+    import shutil
+
+    directory = tempfile.mkdtemp()
+    try:
+        print "   storing and loading ...",
+        cache = FeatureCache(directory, maxBytes = 3000)
+        a = np.arange(100.0)
+        key = cache.key('test', 1, None)
+        assert cache.get(key) is None
+        cache.put(key, a)
+        assert np.array_equal(cache.get(key), a)
+        assert cache.hits == 1 and cache.misses == 1
+        print " done"
+
+        print "   evicting ...",
+        for i in range(5):
+            cache.put(cache.key('test', i + 2), a)
+        assert cache.size() <= 3000
+        print " done"
+
+        print "   hits in a read only cache ...",
+        utime = os.utime
+        def failed(*args):
+            raise OSError(errno.EPERM, 'read only')
+        os.utime = failed
+        try:
+            assert cache.get(cache.key('test', 6)) is not None
+        finally:
+            os.utime = utime
+        print " done"
+    finally:
+        shutil.rmtree(directory)
+
+    print "Done"
@@ -0,0 +1,407 @@
+# Contains writers that stream features to disk
+
+import io
+import numpy as np
+import struct
+
+import Config
+import OnlineFeatures
+
+
+class FeatureWriter(object):
+    """
+    Streaming feature writer
+
+    Feature writers take blocks of frames one at a time (e.g. from
+    OnlineFeatures.push or AudioFile.iterFrames) and append them to a file
+    through a large write buffer, so features can be exported without ever
+    holding the whole matrix in memory. Formats with a header that depends
+    on the number of frames have it filled in by close. Writers can be used
+    as context managers, which closes them at the end of the block.
+
+    Subclasses set the sample type and the header, see HTKWriter, SPTKWriter
+    and NpyWriter.
+
+    Methods
+    -------
+        write:  Appends a block of frames
+        close:  Finishes the header and closes the file
+
+    Attributes (should be treated as read only)
+    ----------
+        path:       File being written
+        frames:     Number of frames written so far
+        frameShape: Shape of each frame, None until the first block
+        closed:     Has the file been closed
+
+
+    Private methods and attributes
+    ------------------------------
+        _file:          The buffered file
+        _type:          numpy dtype the samples are written as
+        _headerSize:    Bytes reserved for the header at the start of the file
+        _dimension():   Number of values in each frame
+        _check(frames): Checks the header can describe the frames before they are written
+        _header():      The header for the frames written so far
+    """
+
+    _headerSize = 0
+
+    def __init__(self, path, bufferBytes = 1 << 22):
+        """ Constructor
+
+        Parameters
+        ----------
+        path: string
+            file to write, replaced if it exists
+        bufferBytes: int, optional
+            size of the write buffer, default 4MB
+        """
+        self.path = path
+        self.frames = 0
+        self.frameShape = None
+        self.closed = False
+        self._file = io.open(path, 'wb', buffering = max(1, int(bufferBytes)))
+        self._file.write(b'\0' * self._headerSize)
+
+    def write(self, block):
+        """ Appends a block of frames
+
+        Parameters
+        ----------
+        block: numpy ndarray
+            one row per frame, a vector is one value per frame (e.g. the energies)
+
+        Returns
+        -------
+        int
+            number of frames written so far
+
+        Raises
+        ------
+        ValueError: if the file is closed, the frames are a different shape to the earlier ones
+            or the format can not describe them
+        """
+        if self.closed:
+            raise ValueError('FeatureWriter.write on a closed file')
+        block = np.asarray(block)
+        if block.ndim == 0:
+            raise ValueError('FeatureWriter.write expects one row per frame')
+        if self.frameShape is None:
+            # the first block sets the shape (and the type if not fixed), unless the header can not describe it
+            typeSet = self._type is None
+            self.frameShape = block.shape[1:]
+            if typeSet:
+                self._type = block.dtype.newbyteorder('=')
+            try:
+                self._check(self.frames + block.shape[0])
+            except ValueError:
+                self.frameShape = None
+                if typeSet:
+                    self._type = None
+                raise
+        elif block.shape[1:] != self.frameShape:
+            raise ValueError('FeatureWriter.write expects frames of shape {0}, got {1}'.format(self.frameShape,
+                                                                                              block.shape[1:]))
+        else:
+            self._check(self.frames + block.shape[0])
+        self._file.write(np.ascontiguousarray(block, dtype = self._type).data)
+        self.frames += block.shape[0]
+        return self.frames
+
+    def close(self):
+        """ Writes the header and closes the file, does nothing if already closed """
+        if self.closed:
+            return
+        try:
+            if self._headerSize:
+                self._file.seek(0)
+                self._file.write(self._header())
+        finally:
+            self._file.close()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def _dimension(self):
+        """ Number of values in each frame """
+        return int(np.prod(self.frameShape)) if self.frameShape is not None else 0
+
+    def _check(self, frames):
+        """ Raises ValueError if the header could not describe frames frames of frameShape """
+        pass
+
+    def _header(self):
+        """ The header for the frames written so far, exactly _headerSize bytes """
+        return b''
+
+
+class HTKWriter(FeatureWriter):
+    """
+    HTK parameter file writer
+
+    Writes the 12 byte HTK header (frames, sample period in 100ns units,
+    bytes per frame and parameter kind) followed by big endian float32
+    frames. See FeatureWriter.
+
+    Attributes (should be treated as read only)
+    ----------
+        frameshift: Time between frames in seconds
+        parmKind:   HTK parameter kind code
+    """
+
+    _headerSize = 12
+
+    # HTK parameter kinds and qualifiers (the HTK book, section 5.10)
+    parmKinds = {'WAVEFORM': 0, 'LPC': 1, 'LPREFC': 2, 'LPCEPSTRA': 3, 'LPDELCEP': 4, 'IREFC': 5,
+                 'MFCC': 6, 'FBANK': 7, 'MELSPEC': 8, 'USER': 9, 'DISCRETE': 10, 'PLP': 11}
+    qualifiers = {'E': 0o100, 'N': 0o200, 'D': 0o400, 'A': 0o1000, 'C': 0o2000, 'Z': 0o4000,
+                  'K': 0o10000, '0': 0o20000, 'V': 0o40000, 'T': 0o100000}
+
+    def __init__(self, path, frameshift = 0.005, parmKind = 'USER', bufferBytes = 1 << 22):
+        """ Constructor
+
+        Parameters
+        ----------
+        path: string
+            file to write, replaced if it exists
+        frameshift: float (sec), optional
+            time between frames, default 0.005 seconds
+        parmKind: string or int, optional
+            parameter kind, e.g. 'MFCC_0' or 'USER', or the numeric code, default 'USER'
+        bufferBytes: int, optional
+            size of the write buffer, default 4MB
+
+        Raises
+        ------
+        ValueError: if the parameter kind is not recognised or the frame shift does not fit the header
+        """
+        self.frameshift = float(frameshift)
+        if not 0 < int(round(self.frameshift * 1e7)) < 2**31:
+            raise ValueError('HTK can not store a frame shift of {0} seconds'.format(self.frameshift))
+        if isinstance(parmKind, basestring):
+            names = parmKind.upper().split('_')
+            if names[0] not in self.parmKinds or any(name not in self.qualifiers for name in names[1:]):
+                raise ValueError('Unknown HTK parameter kind: {0}'.format(parmKind))
+            parmKind = self.parmKinds[names[0]] + sum(self.qualifiers[name] for name in set(names[1:]))
+        self.parmKind = int(parmKind)
+        if not 0 <= self.parmKind < 2**16:
+            raise ValueError('Unknown HTK parameter kind: {0}'.format(parmKind))
+        self._type = np.dtype('>f4')
+        FeatureWriter.__init__(self, path, bufferBytes)
+
+    def _check(self, frames):
+        """ The frame count and bytes per frame must fit the header """
+        if frames >= 2**31:
+            raise ValueError('HTK files can not hold {0} frames'.format(frames))
+        if self._dimension() * self._type.itemsize >= 2**16:
+            raise ValueError('HTK frames can not have {0} values'.format(self._dimension()))
+
+    def _header(self):
+        """ nSamples, sampPeriod, sampSize and parmKind, big endian """
+        return struct.pack('>iiHH', self.frames, int(round(self.frameshift * 1e7)),
+                           self._dimension() * self._type.itemsize, self.parmKind)
+
+
+class SPTKWriter(FeatureWriter):
+    """
+    SPTK raw stream writer
+
+    Writes the frames one after the other with no header, as the SPTK tools
+    read and write them (float, or double for SPTK's +d option, in the
+    machine's byte order). See FeatureWriter.
+    """
+
+    def __init__(self, path, dtype = np.float32, bufferBytes = 1 << 22):
+        """ Constructor
+
+        Parameters
+        ----------
+        path: string
+            file to write, replaced if it exists
+        dtype: numpy dtype, optional
+            numpy.float32 (SPTK +f) or numpy.float64 (SPTK +d), default float32
+        bufferBytes: int, optional
+            size of the write buffer, default 4MB
+
+        Raises
+        ------
+        ValueError: if the type is not float32 or float64
+        """
+        self._type = np.dtype(dtype).newbyteorder('=')
+        if self._type not in (np.dtype(np.float32), np.dtype(np.float64)):
+            raise ValueError('SPTKWriter writes float32 or float64, not {0}'.format(self._type))
+        FeatureWriter.__init__(self, path, bufferBytes)
+
+
+class NpyWriter(FeatureWriter):
+    """
+    Numpy .npy writer
+
+    Writes a version 1.0 .npy file, so the result can be opened with
+    numpy.load, or memory mapped with numpy.load(path, mmap_mode = 'r').
+    The header is padded to a fixed size so the shape can be filled in once
+    the number of frames is known. See FeatureWriter.
+    """
+
+    _headerSize = 128
+
+    def __init__(self, path, dtype = None, bufferBytes = 1 << 22):
+        """ Constructor
+
+        Parameters
+        ----------
+        path: string
+            file to write, replaced if it exists
+        dtype: numpy dtype, optional
+            type of the stored array, default the type of the first block
+        bufferBytes: int, optional
+            size of the write buffer, default 4MB
+        """
+        self._type = None if dtype is None else np.dtype(dtype).newbyteorder('=')
+        FeatureWriter.__init__(self, path, bufferBytes)
+
+    def _check(self, frames):
+        """ The description of the array must fit in the header """
+        self._header(frames)
+
+    def _header(self, frames = None):
+        """ Magic string, version, header length and the array description padded with spaces """
+        dtype = np.dtype(float) if self._type is None else self._type
+        frames = self.frames if frames is None else frames
+        shape = (frames,) + (self.frameShape if self.frameShape is not None else ())
+        description = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False,
+                            'shape': shape}).encode('latin1')
+        start = b'\x93NUMPY\x01\x00'
+        size = self._headerSize - len(start) - 2
+        if len(description) + 1 > size:
+            raise ValueError('NpyWriter cannot describe arrays of shape {0}'.format(shape))
+        return start + struct.pack('<H', size) + description.ljust(size - 1) + b'\n'
+
+
+def export(audioFile, writers, blockSamples = 1 << 20, mfccArgs = None):
+    """ Streams the features of an audio file into writers
+
+    The audio is passed through OnlineFeatures a block of samples at a
+    time, so with a memory mapped file (AudioFile.open with mmap = True)
+    neither the audio nor the features are ever fully in memory. The frame
+    and window settings are those of the audio file, always padded, and the
+    features match SpeechFeatures (see OnlineFeatures), with the energies
+    preemphasised if the audio file has been. The writers are not closed.
+
+    Parameters
+    ----------
+    audioFile: src.AudioFile.AudioFile
+        open and read mono audio file
+    writers: dict
+        feature name ('energy', 'logEnergy' or 'mfcc') to the FeatureWriter it is written to
+    blockSamples: int, optional
+        samples read at a time, default 2**20
+    mfccArgs: dict or Config.MfccConfig, optional
+        settings for the MFCCs, as for SpeechFeatures.mfcc (order, fftLen, lowBand, highBand)
+
+    Returns
+    -------
+    int
+        number of frames written
+
+    Raises
+    ------
+    IOError: if the audio file has not been read
+    KeyError: unknown key in mfccArgs
+    ValueError: if the audio has more than one channel or a feature is not recognised
+    """
+    if not audioFile.read:
+        raise IOError('In FeatureWriter.export input file is not read')
+    if audioFile.data.shape[1] != 1:
+        raise ValueError('FeatureWriter.export only supports mono audio')
+    config = mfccArgs
+    if not isinstance(config, Config.MfccConfig):
+        config = Config.MfccConfig(**dict(mfccArgs or {}))
+    frameConfig, windowConfig = audioFile._configs('export', {})
+    lowBand, highBand = config.bands(audioFile.rate)
+    online = OnlineFeatures.OnlineFeatures(audioFile.rate, frameConfig.frameshift, frameConfig.framewidth,
+                                           frameConfig.centred, windowConfig.windowType,
+                                           windowConfig.normalisation, windowConfig.kaiserBeta,
+                                           0.97 if audioFile.alpha is None else audioFile.alpha,
+                                           config.order, config.fftLen, lowBand, highBand, list(writers),
+                                           audioFile.dtype, audioFile.alpha if audioFile.preemphasised else None)
+    blockSamples = max(1, int(blockSamples))
+    data = audioFile.data[:, 0]
+    frames = 0
+    for start in range(0, data.shape[0] + blockSamples, blockSamples):
+        if start < data.shape[0]:
+            features = online.push(data[start:start + blockSamples])
+        else:
+            features = online.flush()
+        for feature, writer in writers.items():
+            writer.write(features[feature])
+        frames += len(next(iter(features.values()), ()))
+    return frames
+
+
+if __name__ == '__main__':
+    print "Testing FeatureWriter module"
+
+    import os
+    import shutil
+    import tempfile
+    import AudioFile
+    import SpeechFeatures
+
+    directory = tempfile.mkdtemp()
+    try:
+        print "   writing blocks ...",
+        features = np.random.randn(1234, 13)
+        paths = [os.path.join(directory, name) for name in ['a.htk', 'a.raw', 'a.npy']]
+        writers = [HTKWriter(paths[0], 0.01, 'MFCC_0'), SPTKWriter(paths[1]), NpyWriter(paths[2])]
+        for start in range(0, len(features), 100):
+            for writer in writers:
+                writer.write(features[start:start + 100])
+        for writer in writers:
+            writer.close()
+        with open(paths[0], 'rb') as f:
+            assert struct.unpack('>iiHH', f.read(12)) == (1234, 100000, 52, 6 + 0o20000)
+            assert np.array_equal(np.fromfile(f, '>f4').reshape(-1, 13), features.astype(np.float32))
+        assert np.array_equal(np.fromfile(paths[1], np.float32).reshape(-1, 13), features.astype(np.float32))
+        assert np.array_equal(np.load(paths[2], mmap_mode = 'r'), features)
+
+        with HTKWriter(paths[0], 0.01, 'MFCC_0_D_A_T') as writer:
+            writer.write(features)
+        with open(paths[0], 'rb') as f:
+            assert struct.unpack('>iiHH', f.read(12))[3] == 6 + 0o20000 + 0o400 + 0o1000 + 0o100000
+        writer = HTKWriter(paths[0])
+        try:
+            writer.write(np.zeros((1, 2**14))) # 64kB frames do not fit
+            assert False
+        except ValueError:
+            assert writer.frames == 0 and writer.frameShape is None
+        writer.close()
+        with open(paths[0], 'rb') as f:
+            assert struct.unpack('>iiHH', f.read(12)) == (0, 50000, 0, 9)
+        print " done"
+
+        print "   exporting a file ...",
+        af = AudioFile.AudioFile(os.path.join('..','demo','test.raw'), mmap = True)
+        sf = SpeechFeatures.SpeechFeatures(af)
+        with NpyWriter(os.path.join(directory, 'mfcc.npy')) as mfcc:
+            with NpyWriter(os.path.join(directory, 'logEnergy.npy')) as logEnergy:
+                frames = export(af, {'mfcc': mfcc, 'logEnergy': logEnergy}, blockSamples = 10000)
+        assert frames == len(sf.mfcc())
+        assert np.allclose(np.load(os.path.join(directory, 'mfcc.npy')), sf.mfcc(), rtol = 1e-10, atol = 1e-10)
+        assert np.allclose(np.load(os.path.join(directory, 'logEnergy.npy')), sf.logEnergy(), rtol = 1e-10, atol = 1e-10)
+        af.preemphasise(0.9) # the energies are preemphasised too
+        with NpyWriter(os.path.join(directory, 'energy.npy')) as energy:
+            with NpyWriter(os.path.join(directory, 'mfcc.npy')) as mfcc:
+                export(af, {'energy': energy, 'mfcc': mfcc}, blockSamples = 10000)
+        assert np.allclose(np.load(os.path.join(directory, 'energy.npy')), sf.energy(), rtol = 1e-10, atol = 1e-10)
+        assert np.allclose(np.load(os.path.join(directory, 'mfcc.npy')), sf.mfcc(), rtol = 1e-10, atol = 1e-10)
+        print " done"
+    finally:
+        shutil.rmtree(directory)
+
+    print "Done"
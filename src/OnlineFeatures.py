@@ -0,0 +1,220 @@
+# Contains speech features for live audio
+
+import numpy as np
+import os
+
+import algorithms
+
+
+class OnlineFeatures(object):
+    """
+    Online speech features
+
+    Online feature objects extract features from audio that arrives in chunks
+    of any size, e.g. from a live stream. Each call to push returns the
+    features of the frames that were completed by that chunk, and the frame
+    overlap is carried between pushes so the cost of a push only depends on
+    the size of the chunk. Once flushed the concatenated output is the same as
+    SpeechFeatures on an AudioFile of the whole signal framed with pad = True
+    (the MFCCs to rounding, as the FFTs are done in different sized batches).
+
+    Methods
+    -------
+        reset:  Forgets the audio so far
+        push:   Adds samples and returns the features of the completed frames
+        flush:  Pads out the end of the audio and returns the remaining features
+
+    Attributes (should be treated as read only)
+    ----------
+        rate:        Sampling rate of the audio in Hz
+        frameshift:  Shift between frames in seconds
+        framewidth:  Length of the frames in seconds
+        features:    Features returned from each push
+        samples:     Number of samples pushed since the last reset
+        frames:      Number of frames returned since the last reset
+
+
+    Private methods and attributes
+    ------------------------------
+        _frameshiftPT:    The frame shift in data points
+        _framewidthPT:    The frame length in data points
+        _centred:         Is the first sample in the centre of the first frame
+        _windowFunction:  Window applied to each frame
+        _alpha:           Preemphasis constant for the MFCCs
+        _energyAlpha:     Preemphasis constant for the energies, None for none
+        _mfccArgs:        Arguments for algorithms.mfcc
+        _dtype:           Floating point type of the calculations
+        _buffer:          Samples from the start of the next frame onwards
+        _extract(count):  Features of the next count frames in the buffer
+    """
+
+    def __init__(self, rate = 48000, frameshift = 0.005, framewidth = 0.025, centred = True,
+                 windowType = 'blackman', normalisation = 'square sum', kaiserBeta = None, alpha = 0.97,
+                 order = 60, fftLen = None, lowBand = 0, highBand = None,
+                 features = ['energy', 'logEnergy', 'mfcc'], dtype = None, energyAlpha = None):
+        """ Constructor
+
+        The defaults match those of AudioFile and SpeechFeatures
+
+        Parameters
+        ----------
+        rate: float, optional
+            sampling rate of the audio in Hz, default 48000
+        frameshift: float (sec), optional
+            frame shift, default 0.005 seconds
+        framewidth: float (sec), optional
+            length of each frame, default 0.025 seconds
+        centred: boolean, optional
+            first sample is in the centre of the first frame rather than the start, default true
+        windowType: string, optional
+            window type, see AudioFile.window, default blackman
+        normalisation: string, optional
+            window normalisation, see AudioFile.window, default square sum
+        kaiserBeta: float, optional
+            beta for kaiser windows
+        alpha: float, optional
+            preemphasis constant for the MFCCs, default 0.97
+        order: int, optional
+            order of the MFCCs, default 60
+        fftLen: int, optional
+            length of the FFT, default the frame width
+        lowBand: float, optional
+            lowest band for the mel filters, default 0Hz
+        highBand: float, optional
+            highest band of the mel filters, default rate / 2
+        features: list of {'energy', 'logEnergy', 'mfcc'}, optional
+            features to return, default all of them
+        dtype: numpy dtype, optional
+            floating point type of the calculations, default float64
+        energyAlpha: float, optional
+            preemphasis constant for the energies, default None as they are not preemphasised
+            (SpeechFeatures preemphasises them when the audio file has been)
+
+        Raises
+        ------
+        ValueError: if a feature or the window is not recognised
+        """
+        self.features = list(features)
+        for feature in self.features:
+            if feature not in ['energy', 'logEnergy', 'mfcc']:
+                raise ValueError('Unknown feature in OnlineFeatures: {0}'.format(feature))
+        self.rate = float(rate)
+        self.frameshift = float(frameshift)
+        self.framewidth = float(framewidth)
+
+        self._frameshiftPT = int(self.frameshift * self.rate)
+        self._framewidthPT = int(self.framewidth * self.rate)
+        self._centred = not centred == False
+        self._dtype = np.dtype(float if dtype is None else dtype)
+        self._windowFunction = algorithms.window(windowType.lower(), self._framewidthPT, normalisation.lower(),
+                                                 kaiserBeta, self._dtype)
+        self._alpha = alpha
+        self._energyAlpha = energyAlpha
+        if highBand is None:
+            highBand = self.rate / 2
+        self._mfccArgs = {'order':int(order), 'samplerate':self.rate, 'fftLen':fftLen,
+                          'low':lowBand, 'high':highBand}
+        self.reset()
+
+    def reset(self):
+        """ Forgets the audio so far, ready for a new stream """
+        self.samples = 0
+        self.frames = 0
+        # centred streams start half a frame of zeros before the first sample
+        self._buffer = np.zeros(self._framewidthPT // 2 if self._centred else 0, dtype = self._dtype)
+
+    def push(self, samples):
+        """ Adds samples to the stream
+
+        Parameters
+        ----------
+        samples: numpy ndarray
+            the next samples of the mono audio, a vector or a single column
+
+        Returns
+        -------
+        dict
+            feature name to the rows for each frame completed by these samples
+
+        Raises
+        ------
+        ValueError: if the samples have more than one channel
+        """
+        samples = np.asarray(samples)
+        if not (samples.ndim == 1 or (samples.ndim == 2 and samples.shape[1] == 1)):
+            raise ValueError('OnlineFeatures.push expects mono samples, got shape {0}'.format(samples.shape))
+        samples = np.ravel(samples)
+        self.samples += samples.size
+        self._buffer = np.concatenate((self._buffer, samples.astype(self._dtype, copy = False)))
+        count = 0
+        if self._buffer.size >= self._framewidthPT:
+            count = (self._buffer.size - self._framewidthPT) // self._frameshiftPT + 1
+        return self._extract(count)
+
+    def flush(self):
+        """ Ends the stream
+
+        Zero pads the end of the audio so there is a frame for every frame
+        shift, like AudioFile.frame with pad = True, and then resets
+
+        Returns
+        -------
+        dict
+            feature name to the rows for each of the remaining frames
+        """
+        count = (self.samples + self._frameshiftPT - 1) // self._frameshiftPT - self.frames
+        needed = max(0, (count - 1) * self._frameshiftPT + self._framewidthPT)
+        if needed > self._buffer.size:
+            self._buffer = np.concatenate((self._buffer, np.zeros(needed - self._buffer.size, dtype = self._dtype)))
+        result = self._extract(count)
+        self.reset()
+        return result
+
+    def _extract(self, count):
+        """ Features of the next count frames, which are then dropped from the buffer """
+        result = {}
+        if 'energy' in self.features or 'logEnergy' in self.features:
+            windowed = algorithms.windowedBlock(self._buffer, count, self._frameshiftPT, self._framewidthPT,
+                                                self._windowFunction, self._energyAlpha)
+            energy, logEnergy = algorithms.energy(windowed)
+            if 'energy' in self.features: result['energy'] = energy
+            if 'logEnergy' in self.features: result['logEnergy'] = logEnergy
+        if 'mfcc' in self.features:
+            windowed = algorithms.windowedBlock(self._buffer, count, self._frameshiftPT, self._framewidthPT,
+                                                self._windowFunction, self._alpha)
+            result['mfcc'] = algorithms.mfcc(windowed, **self._mfccArgs)
+        # keep the overlap with the frames still to come
+        self._buffer = self._buffer[count * self._frameshiftPT:].copy()
+        self.frames += count
+        return result
+
+
+if __name__ == '__main__':
+    print "Testing OnlineFeatures module"
+
+    import AudioFile
+    import SpeechFeatures
+
+    af = AudioFile.AudioFile(os.path.join('..','demo','test.raw'))
+    sf = SpeechFeatures.SpeechFeatures(af)
+
+    print "   streaming in random chunks ...",
+    of = OnlineFeatures(af.rate)
+    signal = np.ravel(af.data)
+    chunks = np.cumsum(np.random.randint(1, 2000, signal.size // 500))
+    parts = [of.push(chunk) for chunk in np.split(signal, chunks[chunks < signal.size])] + [of.flush()]
+    for feature in of.features:
+        streamed = np.concatenate([part[feature] for part in parts])
+        assert np.allclose(streamed, getattr(sf, feature)(), rtol = 1e-10, atol = 1e-10)
+    print " done"
+
+    print "   rejecting more than one channel ...",
+    of.push(af.data[:100]) # a single column is mono
+    try:
+        of.push(np.zeros((100, 2)))
+        assert False
+    except ValueError:
+        assert of.samples == 100
+    print " done"
+
+    print "Done"
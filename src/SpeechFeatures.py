@@ -1,11 +1,17 @@
 # Contains speech features
 
+import hashlib
+import multiprocessing
 import numpy as np
 import os
 import warnings
 import AudioFile  
+import Config
 
 import algorithms 
+from algorithms import instrument
+
+_defaultMfccConfig = Config.MfccConfig()
 
 class SpeechFeatures:
     """
@@ -22,11 +28,26 @@ class SpeechFeatures:
         energy:    Returns framewise energy
         logEnergy: Returns framewise log energy
         mfcc:      Returns the framewise mfccs
+        vad:       Returns which frames are voiced
+        voicedMfcc: Returns the mfccs of the voiced frames only
+        extractBatch: Extracts features from a list of files over a process pool
+        extractPacked: Extracts features from a list of audio files packed into one batch
 
     Attributes (should be treated as read only)
     ----------
         name:      The original file name
         mfccOrder: Order of the MFCCs if they have been calculated
+        dtype:     Floating point type features are calculated in, None to follow the audio file
+        cache:     FeatureCache the features are stored in and loaded from, None for no cache
+
+    Setting dtype to numpy.float32 (here or on the AudioFile) keeps the frames, 
+    windows, spectra, filter banks and features in float32. Compared to the 
+    float64 path the energies agree to a relative tolerance of 1e-5 and the
+    MFCCs to an absolute tolerance of 1e-3 (see the module self test).
+
+    With a cache (see FeatureCache) features are looked up by a hash of the 
+    audio samples and every setting that affects them before they are 
+    calculated, features loaded from the cache are read only.
 
 
     Private methods and attributes
@@ -34,13 +55,24 @@ class SpeechFeatures:
         _audiofile:     AudioFile object
         _energy:        stored energy
         _logEnergy:     stored logEnergy 
+        _energyKey:     preemphasis, frame and window settings of the stored energies
         _mfcc:          stored coefficients   
-        _fftLen:        FFT length for all analysis 
-        _mfccLowBand:   Lowest band for the mel filters
-        _mfccHighBand:  Highest band of the mel filters
+        _mfccConfig:    Config.MfccConfig of the stored coefficients
+        _mfccKey:       MFCC, preemphasis, frame and window settings of the stored coefficients
+        _vad:           stored voiced frame mask
+        _vadSettings:   margin, window and hangover of the stored mask
+        _vadKey:        Voice activity, preemphasis, frame and window settings of the stored mask
+        _mfccConfigFrom(...): MfccConfig from the arguments of mfcc and the previous settings
+        _mfccAlpha():   Preemphasis constant of the MFCCs
+        _energies():    Calculates the energy and log energy
+        _audioHash:     Data version of the audio and the hash of its samples and rate
+        _settingsKey(alpha): Preemphasis, data version, frame and window settings features would use
+        _cached(...):   Loads a feature from the cache or calculates and stores it
+        _windowed():    Preemphasised and windowed audio in the feature type
+        _audioAlpha():  Preemphasis constant of the audio file if it is preemphasised
     """
 
-    def __init__(self, audiofile = None):
+    def __init__(self, audiofile = None, dtype = None, cache = None):
         """ Constructor 
         
         can function as an interface to setAudio
@@ -50,7 +82,15 @@ class SpeechFeatures:
         audioFile: {None, src.AudioFile.AudioFile}, optional 
             if an audio file is passed it will set the audio data
             to be the given object 
+        dtype: numpy dtype, optional
+            floating point type to calculate the features in (e.g. numpy.float32),
+            default follows the audio file. It is kept when the audio is changed
+        cache: FeatureCache, optional
+            on disk cache to keep the features in, default None for no cache. 
+            It is kept when the audio is changed
         """            
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.cache = cache
         self.clear()
         if audiofile:
             self.setAudio(audiofile)
@@ -63,10 +103,14 @@ class SpeechFeatures:
         self._audiofile    = None # Source file data
         self._energy       = None # Stored version of the energy
         self._logEnergy    = None # Stored version of the log energy
+        self._energyKey    = None # Settings the energies were calculated with
         self._mfcc         = None # MFCCs
-        self._fftLen       = None # FFT length defaults to whole frame
-        self._mfccLowBand  = None # Lowest band for the mel filters
-        self._mfccHighBand = None # Highest band of the mel filters
+        self._mfccConfig   = None # Settings of the MFCCs
+        self._mfccKey      = None # Settings and preemphasis, frame and window settings of the MFCCs
+        self._audioHash    = None # Hash of the audio for the cache
+        self._vad          = None # Voiced frame mask
+        self._vadSettings  = None # Margin, window and hangover of the mask
+        self._vadKey       = None # Settings and preemphasis, frame and window settings of the mask
         
     def setAudio(self, audioFile):
         """ Sets the audio data for analysis
@@ -94,13 +138,13 @@ class SpeechFeatures:
             raise ValueError('SpeechFeatures.setAudio expects an AudioFile')  
 
     def energy(self):
-        if (self._energy is None) or (self._logEnergy is None):
-            self._energy, self._logEnergy = algorithms.energy(self._audiofile.window())
+        if (self._energy is None) or (self._energyKey != self._settingsKey(self._audioAlpha())):
+            self._energies()
         return self._energy  
 
     def logEnergy(self):
-        if (self._energy is None) or (self._logEnergy is None):
-            self._energy, self._logEnergy = algorithms.energy(self._audiofile.window())
+        if (self._energy is None) or (self._energyKey != self._settingsKey(self._audioAlpha())):
+            self._energies()
         return self._logEnergy   
     
     def mfcc(self, order = None, fftLen = None, **kwargs):
@@ -112,8 +156,9 @@ class SpeechFeatures:
         
         Parameters
         ----------
-        order: int, optional
-            order of the MFCCs, default to previous value or 60 if none given before
+        order: int or Config.MfccConfig, optional
+            order of the MFCCs, default to previous value or 60 if none given before.
+            An MfccConfig gives all of the settings at once
         fftLen: int, optional
             window length for the FFT, defaults to whole frame
             
@@ -124,72 +169,421 @@ class SpeechFeatures:
             lowest band for the mel filters, default to previous or 0Hz
         highBand: float, optional
             highest band for the mel filters, default to previous or (sampling rate / 2)
+        workers: int, optional
+            number of threads to calculate the MFCCs with, default one, the result
+            is the same for any number (see algorithms.mfcc)
             
         Returns
         -------
         Numpy ndarray
             MFCCs for each frame
         """
-        defaults = {'order':order,'fftLen':fftLen,'lowBand':None, 'highBand':None}    
+        workers = kwargs.pop('workers', None)
+        config = self._mfccConfigFrom('mfcc', order, fftLen, kwargs)
+        alpha = self._mfccAlpha()
+        key = (config, self._settingsKey(alpha))
+        if self._mfcc is None or key != self._mfccKey:
+            lowBand, highBand = config.bands(self._audiofile.rate)
+            self._mfcc = self._cached(lambda: algorithms.mfcc(self._windowed(alpha), config.order, self._audiofile.rate, 
+                                                             config.fftLen, lowBand, highBand, workers = workers),
+                                      'mfcc', alpha, config.order, config.fftLen, lowBand, highBand)
+            self.mfccOrder = self._mfcc.shape[-1]
+            self._mfccConfig = config
+            self._mfccKey = key
+        return self._mfcc
+
+    def vad(self, margin = None, window = None, hangover = None):
+        """ Finds the voiced frames
+
+        Energy based voice activity detection on the log energy, as implemented
+        in algorithms.vad. Only recalculated if the parameters, or the frame
+        and window settings of the audio, have been changed
+
+        Parameters
+        ----------
+        margin: float, optional
+            how far above the noise floor voiced frames are in dB, default to previous or 12dB
+        window: float (sec), optional
+            length of previous audio the noise floor is taken over, default to previous or 5 seconds
+        hangover: float (sec), optional
+            length of audio kept after each voiced frame, default to previous or 0.1 seconds
+
+        Returns
+        -------
+        Numpy ndarray
+            boolean mask of the frames, True if voiced, for multi-channel audio if voiced in any channel
+        """
+        current = self._vadSettings or (12.0, 5.0, 0.1)
+        settings = (current[0] if margin is None else float(margin),
+                    current[1] if window is None else float(window),
+                    current[2] if hangover is None else float(hangover))
+        key = (settings, self._settingsKey(self._audioAlpha()))
+        if self._vad is None or key != self._vadKey:
+            frameshift = self._audiofile._configs('vad', {})[0].frameshift
+            logEnergy = self.logEnergy()
+            with instrument.stage('vad'):
+                self._vad = algorithms.vad(logEnergy, settings[0], max(1, int(round(settings[1] / frameshift))),
+                                           int(round(settings[2] / frameshift)))
+            self._vad.flags.writeable = False
+            self._vadSettings = settings
+            self._vadKey = key
+        return self._vad
+
+    def voicedMfcc(self, fill = None, order = None, fftLen = None, **kwargs):
+        """ Calculate the MFCCs of the voiced frames
+
+        Only the frames vad finds voiced go through the FFT, filter bank and
+        DCT, so the cost falls with the amount of silence. The coefficients
+        of each voiced frame are the same as the corresponding row of mfcc
+        (and are taken from it if it has already been calculated)
+
+        Parameters
+        ----------
+        fill: float, optional
+            value for the rows of the unvoiced frames (e.g. numpy.nan), default None
+            drops them, the rows are then the frames numpy.flatnonzero(vad())
+        order, fftLen
+            as for mfcc
+
+        Keyword arguments
+        -----------------
+        lowBand, highBand, workers
+            as for mfcc
+
+        Returns
+        -------
+        Numpy ndarray
+            MFCCs for the voiced frames, or for every frame with the unvoiced ones set to fill
+        """
+        workers = kwargs.pop('workers', None)
+        config = self._mfccConfigFrom('voicedMfcc', order, fftLen, kwargs)
+        alpha = self._mfccAlpha()
+        voiced = self.vad()
+        if self._mfcc is not None and (config, self._settingsKey(alpha)) == self._mfccKey:
+            coefficients = self._mfcc[..., voiced, :]
+        else:
+            lowBand, highBand = config.bands(self._audiofile.rate)
+            coefficients = algorithms.mfcc(self._windowed(alpha)[..., voiced, :], config.order, self._audiofile.rate,
+                                           config.fftLen, lowBand, highBand, workers = workers)
+        if fill is None:
+            return coefficients
+        filled = np.empty(coefficients.shape[:-2] + (voiced.size, coefficients.shape[-1]), dtype = coefficients.dtype)
+        filled[...] = fill
+        filled[..., voiced, :] = coefficients
+        return filled
+
+      
+
+
+    def _mfccConfigFrom(self, caller, order, fftLen, kwargs):
+        """ The MfccConfig from the arguments of mfcc and the previous settings """
+        if isinstance(order, Config.MfccConfig):
+            for key in kwargs:
+                raise KeyError('Unknown key in SpeechFeatures.{0}: {1}'.format(caller, key))
+            return order
         for key in kwargs:
-            if key not in defaults.keys():
-                raise KeyError('Unknown key in SpeechFeatures.mfcc: {0}'.format(key))
-        for key in defaults:
-            if key not in kwargs.keys():
-                kwargs[key] = defaults[key]
+            if key not in ['lowBand', 'highBand']:
+                raise KeyError('Unknown key in SpeechFeatures.{0}: {1}'.format(caller, key))
+        current = self._mfccConfig or _defaultMfccConfig
+        lowBand = kwargs.get('lowBand')
+        highBand = kwargs.get('highBand')
+        if ((order is None or order == current.order) and fftLen == current.fftLen and 
+            (lowBand is None or lowBand == current.lowBand) and 
+            (highBand is None or highBand == current.highBand)):
+            return current
+        return Config.MfccConfig(current.order if order is None else order, 
+                                 fftLen, # None is always the frame width
+                                 current.lowBand if lowBand is None else lowBand, 
+                                 current.highBand if highBand is None else highBand)
+
+    def _mfccAlpha(self):
+        """ Preemphasis constant of the MFCCs, always preemphasised with the audio file's constant if it has one """
+        if self._audiofile.alpha is None:
+            return 0.97
+        return self._audiofile.alpha
+
+    def _energies(self):
+        """ Calculates and stores the energy and log energy """
+        alpha = self._audioAlpha()
+        energies = []
+        def calculate():
+            windowed = self._windowed(alpha)
+            with instrument.stage('energy'):
+                energies.extend(algorithms.energy(windowed))
+                instrument.allocated(energies[0].nbytes + energies[1].nbytes)
+            return energies[0]
+        self._energy = self._cached(calculate, 'energy', alpha)
+        self._logEnergy = self._cached(lambda: energies[1] if energies else np.log(self._energy), 'logEnergy', alpha)
+        self._energyKey = self._settingsKey(alpha)
+
+    def _settingsKey(self, alpha):
+        """ The preemphasis, data version, frame and window settings features would be calculated with """
+        return (alpha, self.dtype, self._audiofile._dataVersion) + self._audiofile._configs('windowFrames', {})
+
+    def _cached(self, calculate, feature, *settings):
+        """ Returns a feature from the cache, or calculate() stored in the cache 
         
-        if kwargs['order'] is None: 
-            if self.mfccOrder is None: 
-                order = 60
-            else:
-                order = self.mfccOrder            
-        else:
-            order = int(kwargs['order'])    
-            
-        if kwargs['fftLen'] is None: 
-            fftLen = self._audiofile.window().shape[1]  
-        else:
-            fftLen = int(kwargs['fftLen']) 
+        The key is made from the feature name and settings, the audio hash, 
+        the frame and window settings of the audio file and the dtypes
+        """
+        if self.cache is None:
+            return calculate()
+        af = self._audiofile
+        if self._audioHash is None or self._audioHash[0] != af._dataVersion: # another file or resampled
+            hasher = hashlib.sha1()
+            data = np.ravel(af.data)
+            for start in range(0, data.size, 1 << 20):
+                hasher.update(np.ascontiguousarray(data[start:start + (1 << 20)]).tobytes())
+            self._audioHash = (af._dataVersion, (hasher.hexdigest(), str(data.dtype), af.data.shape[1], af.rate))
+        frameConfig, windowConfig = af._configs('windowFrames', {})
+        key = self.cache.key(feature, settings, self._audioHash[1], frameConfig.key(), windowConfig.key(), 
+                             str(af.dtype), str(self.dtype))
+        result = self.cache.get(key)
+        if result is None:
+            result = calculate()
+            self.cache.put(key, result)
+        return result
+
+    def _windowed(self, alpha = None):
+        """ The preemphasised and windowed audio in the feature type, from the fused stage """
+        return self._audiofile.windowFrames(alpha, dtype = self.dtype)
+
+    def _audioAlpha(self):
+        """ The audio file's preemphasis constant if it has been preemphasised """
+        if self._audiofile.preemphasised:
+            return self._audiofile.alpha
+        return None
+
+    @staticmethod
+    def extractBatch(paths, features = ['mfcc', 'logEnergy'], workers = None, progress = None, 
+                     openArgs = None, mfccArgs = None, chunksize = None, dtype = None, collector = None, 
+                     cache = None):
+        """ Extract features from many files over a process pool
         
-        lowBand = kwargs['lowBand']
-        if lowBand is None:
-            if self._mfccLowBand is None:
-                lowBand = 0
-            else:
-                lowBand = self._mfccLowBand
-        else:
-            lowBand = self._mfccLowBand
-                
-        highBand = kwargs['highBand']
-        if highBand is None:
-            if self._mfccHighBand is None:
-                highBand = self._audiofile.rate/2
-            else:
-                highBand = self._mfccHighBand
-        else:
-            highBand = self._mfccHighBand
+        Each worker process keeps one AudioFile and SpeechFeatures object for
+        all of the files it is given, so anything cached at module level 
+        (e.g. window functions and filter banks) is set up once per worker 
+        rather than once per file.
         
+        Parameters
+        ----------
+        paths: list of strings
+            audio files to process
+        features: list of {'energy', 'logEnergy', 'mfcc'}, optional
+            features to extract from each file, default ['mfcc', 'logEnergy']
+        workers: int, optional
+            number of worker processes, default is the number of CPUs, 
+            if 1 then the files are processed in this process
+        progress: callable, optional
+            called as progress(done, total) after each file
+        openArgs: dict, optional
+            keyword arguments for AudioFile.open (e.g. fType, rate, encoding, mmap)
+        mfccArgs: dict, optional
+            keyword arguments for SpeechFeatures.mfcc (e.g. order, fftLen)
+        chunksize: int, optional
+            files sent to a worker at a time, default is chosen from the 
+            number of files and workers
+        dtype: numpy dtype, optional
+            floating point type for the calculations, see SpeechFeatures
+        collector: algorithms.instrument.Collector, optional
+            if given the stage timings of every file, from all of the workers, 
+            are added to it (see algorithms.instrument)
+        cache: FeatureCache, optional
+            on disk cache shared by the workers, see SpeechFeatures
         
-        if  self._mfcc is None \
-            or (self.mfccOrder != order) \
-            or (fftLen != self._fftLen) \
-            or (lowBand != self._mfccLowBand) \
-            or (highBand != self._mfccHighBand):
+        Returns
+        -------
+        list of dicts
+            for each path in order a dictionary from feature name to numpy ndarray
             
-            self._audiofile.frame()
-            emphasised = False
-            if not self._audiofile.preemphasised:
-                emphasised = True
-                self._audiofile.preemphasise()
-        
-            self._mfcc = algorithms.mfcc(self._audiofile.window(), order, self._audiofile.rate, fftLen, lowBand, highBand)
-            if emphasised:
-                self._audiofile.unemphasise() # if it was not preemphasised revert
-            self.mfccOrder = self._mfcc.shape[1]
-            self._fftLen = fftLen
-        return self._mfcc 
+        Raises
+        ------
+        ValueError: if a feature is not recognised
+        """
+        features = list(features)
+        for feature in features:
+            if feature not in _batchFeatures:
+                raise ValueError('Unknown feature in SpeechFeatures.extractBatch: {0}'.format(feature))
+        paths = list(paths)
+        total = len(paths)
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = max(1, min(int(workers), total))
+        if chunksize is None:
+            chunksize = max(1, total // (workers * 8))
+        setup = (features, dict(openArgs or {}), dict(mfccArgs or {}), dtype, collector is not None, cache)
         
-      
+        results = []
+        def done(result):
+            result, totals = result
+            results.append(result)
+            if collector is not None:
+                collector.merge(totals)
+            if progress is not None:
+                progress(len(results), total)
+
+        if workers == 1:
+            _initBatchWorker(*setup)
+            try:
+                for path in paths:
+                    done(_batchWorker(path))
+            finally:
+                _endBatchWorker()
+            return results
+            
+        pool = multiprocessing.Pool(workers, _initBatchWorker, setup)
+        try:
+            # imap keeps the submission order
+            for result in pool.imap(_batchWorker, paths, chunksize):
+                done(result)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return results
+
+    @staticmethod
+    def extractPacked(audioFiles, features = ['mfcc', 'logEnergy'], mfccArgs = None, dtype = None, workers = None):
+        """ Extract features from many short audio files in one pass
+
+        The windowed frames of all of the files are packed into one array
+        (see algorithms.packedFrames) and the energy and MFCCs are calculated
+        once over it, so the FFT, filter bank and DCT work on large blocks
+        rather than a few hundred frames at a time. Each file uses its own
+        frame, window and preemphasis settings, and its features are the same
+        as SpeechFeatures(audioFile, dtype).energy() etc. The files must have
+        the same sample rate, frame width and number of channels. Nothing is
+        stored on the files and no FeatureCache is used.
+
+        Parameters
+        ----------
+        audioFiles: list of src.AudioFile.AudioFile
+            open and read audio files
+        features: list of {'energy', 'logEnergy', 'mfcc'}, optional
+            features to extract from each file, default ['mfcc', 'logEnergy']
+        mfccArgs: dict or Config.MfccConfig, optional
+            settings for the MFCCs, as for SpeechFeatures.mfcc (order, fftLen, lowBand, highBand)
+        dtype: numpy dtype, optional
+            floating point type for the calculations, see SpeechFeatures
+        workers: int, optional
+            number of threads to calculate the MFCCs with, see SpeechFeatures.mfcc
+
+        Returns
+        -------
+        list of dicts
+            for each file in order a dictionary from feature name to numpy ndarray,
+            the arrays are views of the packed result
+
+        Raises
+        ------
+        IOError: if an audio file has not been read
+        KeyError: unknown key in mfccArgs
+        ValueError: if a feature is not recognised or the files cannot be packed together
+        """
+        features = list(features)
+        for feature in features:
+            if feature not in _batchFeatures:
+                raise ValueError('Unknown feature in SpeechFeatures.extractPacked: {0}'.format(feature))
+        audioFiles = list(audioFiles)
+        if not audioFiles:
+            return []
+        for af in audioFiles:
+            if not af.read:
+                raise IOError('In SpeechFeatures.extractPacked input file is not read')
+        config = mfccArgs
+        if not isinstance(config, Config.MfccConfig):
+            mfccArgs = dict(mfccArgs or {})
+            for key in mfccArgs:
+                if key not in Config.MfccConfig.fields:
+                    raise KeyError('Unknown key in SpeechFeatures.extractPacked: {0}'.format(key))
+            config = Config.MfccConfig(**mfccArgs)
+        rate = audioFiles[0].rate
+        if any(af.rate != rate for af in audioFiles):
+            raise ValueError('SpeechFeatures.extractPacked needs all of the files at the same sample rate')
+        settings = [af._frameSettings('windowFrames', {}) for af in audioFiles]
+        framewidth = settings[0][1]
+        if any(setting[1] != framewidth for setting in settings):
+            raise ValueError('SpeechFeatures.extractPacked needs the same frame width for all of the files')
+        if any(af.data.shape[1] != audioFiles[0].data.shape[1] for af in audioFiles):
+            raise ValueError('SpeechFeatures.extractPacked needs the same number of channels in all of the files')
+        dtype = None if dtype is None else np.dtype(dtype)
+
+        # the type each file's windowFrames would give
+        types = [np.result_type(af.data.dtype, setting[4].dtype) if af.dtype is None else af.dtype
+                 for af, setting in zip(audioFiles, settings)]
+        shifts, _, pads, centreds, windows = zip(*settings)
+        def packed(alphas):
+            """ The windowed frames of every file, preemphasised with its alpha, and the offsets """
+            with instrument.stage('windowFrames'):
+                return algorithms.packedFrames([af.data for af in audioFiles], shifts, framewidth, windows, alphas,
+                                               pads, centreds, np.result_type(*types) if dtype is None else dtype)
+
+        results = [{} for af in audioFiles]
+        def split(feature, values, offsets, axis):
+            for result, value in zip(results, np.split(values, offsets[1:-1], axis)):
+                result[feature] = value
+
+        if 'energy' in features or 'logEnergy' in features:
+            frames, offsets = packed([af.alpha if af.preemphasised else None for af in audioFiles])
+            with instrument.stage('energy'):
+                energy, logEnergy = algorithms.energy(frames)
+                instrument.allocated(energy.nbytes + logEnergy.nbytes)
+            split('energy', energy, offsets, -1)
+            split('logEnergy', logEnergy, offsets, -1)
+        if 'mfcc' in features:
+            # always preemphasised, with the audio file's constant if it has one
+            frames, offsets = packed([0.97 if af.alpha is None else af.alpha for af in audioFiles])
+            lowBand, highBand = config.bands(rate)
+            mfccs = algorithms.mfcc(frames, config.order, rate, config.fftLen, lowBand, highBand, workers = workers)
+            split('mfcc', mfccs, offsets, -2)
+        for result in results:
+            for feature in list(result):
+                if feature not in features:
+                    del result[feature]
+        return results
+
+
+_batchFeatures = ['energy', 'logEnergy', 'mfcc'] # features extractBatch can produce
+_batchState = {} # per process state for extractBatch workers
+
+def _initBatchWorker(features, openArgs, mfccArgs, dtype, instrumented, cache):
+    """ Set up the objects reused for every file given to this process """
+    _batchState['collector'] = None
+    if instrumented:
+        _batchState['collector'] = instrument.Collector()
+        instrument.addCollector(_batchState['collector'])
+    _batchState['features'] = features
+    _batchState['openArgs'] = openArgs
+    _batchState['mfccArgs'] = mfccArgs
+    _batchState['audio'] = AudioFile.AudioFile(dtype = dtype)
+    _batchState['speech'] = SpeechFeatures(dtype = dtype, cache = cache)
+
+def _endBatchWorker():
+    """ Undoes _initBatchWorker when the batch was run in this process """
+    if _batchState.get('collector') is not None:
+        instrument.removeCollector(_batchState['collector'])
+    _batchState.clear()
+
+def _batchWorker(path):
+    """ Extract the features for one file of a batch, with the stage totals if instrumented """
+    collector = _batchState['collector']
+    if collector is not None:
+        collector.stages = {}
+    af = _batchState['audio']
+    sf = _batchState['speech']
+    af.open(path, **_batchState['openArgs'])
+    sf.setAudio(af)
+    result = {}
+    for feature in _batchState['features']:
+        if feature == 'mfcc':
+            result[feature] = sf.mfcc(**_batchState['mfccArgs'])
+        else:
+            result[feature] = getattr(sf, feature)()
+    af.clear()
+    sf.clear()
+    return result, None if collector is None else collector.totals()
 
 
 if __name__ == '__main__':
@@ -203,31 +597,291 @@ if __name__ == '__main__':
     sf.logEnergy()
     sf.mfcc()
 
+    print "   float32 against float64 ...",
+    sf64 = SpeechFeatures(AudioFile.AudioFile(os.path.join('..','demo','test.raw')))
+    sf32 = SpeechFeatures(AudioFile.AudioFile(os.path.join('..','demo','test.raw'), dtype = np.float32))
+    assert np.allclose(sf32.energy(), sf64.energy(), rtol = 1e-5, atol = 0)
+    mfcc32 = sf32.mfcc()
+    assert mfcc32.dtype == np.float32
+    # float32 samples, but the frames are float64 unless asked for
+    assert sf64._audiofile.data.dtype == np.float32 and sf64._audiofile.frame().dtype == np.float64
+    assert sf32._audiofile.frame().dtype == np.float32
+    assert np.allclose(mfcc32, sf64.mfcc(), rtol = 0, atol = 1e-3)
+    print " done"
+
+    print "   float32 from other sample types ...",
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'double.raw')
+        np.ravel(sf64._audiofile.data).astype(np.float64).tofile(path)
+        sfDouble = SpeechFeatures(AudioFile.AudioFile(path, encoding = 'double', bitdepth = 64, dtype = np.float32))
+        assert sfDouble._audiofile.data.dtype == np.float64
+        assert sfDouble.energy().dtype == np.float32 and sfDouble.mfcc().dtype == np.float32
+        assert np.allclose(sfDouble.mfcc(), sf64.mfcc(), rtol = 0, atol = 1e-3)
+        assert SpeechFeatures.extractPacked([sfDouble._audiofile])[0]['mfcc'].dtype == np.float32
+    finally:
+        shutil.rmtree(directory)
+    print " done"
+
+    print "   reading WAV files ...",
+    import struct
+    def writeWav(path, samples, formatTag, bitdepth, channels = 1, rate = 22050, extensible = False):
+        """ Writes samples (already bytes) as a WAV file, with an odd sized chunk before the data """
+        blockAlign = channels * bitdepth // 8
+        fmt = struct.pack('<HHIIHH', 0xFFFE if extensible else formatTag, channels, rate, rate * blockAlign,
+                          blockAlign, bitdepth)
+        if extensible:
+            # the sub format GUID starts with the format tag
+            fmt += struct.pack('<HHI', 22, bitdepth, (1 << channels) - 1) + struct.pack('<H', formatTag) + \
+                   b'\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71'
+        chunks = [b'fmt ' + struct.pack('<I', len(fmt)) + fmt, b'LIST' + struct.pack('<I', 3) + b'abc\x00',
+                  b'data' + struct.pack('<I', len(samples)) + samples]
+        with open(path, 'wb') as f:
+            f.write(b'RIFF' + struct.pack('<I', 4 + sum(len(chunk) for chunk in chunks)) + b'WAVE' + b''.join(chunks))
+    random = np.random.RandomState(0)
+    int16 = (random.randn(1001) * 8000).astype('<i2')
+    int24 = random.randint(-2**23, 2**23, 1001).astype('<i4')
+    float32 = random.randn(1001).astype('<f4')
+    stereo = (random.randn(1001, 2) * 8000).astype('<i2')
+    wavs = [('16.wav', int16.tobytes(), 1, 16, 1, False, int16),
+            ('24.wav', int24.view(np.uint8).reshape((-1, 4))[:, :3].tobytes(), 1, 24, 1, False, int24),
+            ('float.wav', float32.tobytes(), 3, 32, 1, False, float32),
+            ('extensible.wav', stereo.tobytes(), 1, 16, 2, True, stereo)]
+    directory = tempfile.mkdtemp()
+    try:
+        for name, samples, formatTag, bitdepth, channels, extensible, expected in wavs:
+            path = os.path.join(directory, name)
+            writeWav(path, samples, formatTag, bitdepth, channels, extensible = extensible)
+            for mmap in [False, True]:
+                afWav = AudioFile.AudioFile(path, mmap = mmap)
+                assert afWav.rate == 22050 and afWav.channels == channels and afWav.bitdepth == bitdepth
+                assert np.array_equal(afWav.data, expected.reshape((expected.shape[0], -1)))
+                afWav.clear() # drop the map so the file can be removed
+    finally:
+        shutil.rmtree(directory)
+    print " done"
+
+    print "   reading ASCII files ...",
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'values.txt')
+        with open(path, 'w') as f:
+            f.write('# two channels\n')
+            np.savetxt(f, np.random.RandomState(0).randn(5000, 2))
+        expected = np.loadtxt(path)
+        assert np.array_equal(AudioFile.AudioFile(path).data, expected)
+        afText = AudioFile.AudioFile(path, sidecar = True)
+        assert np.array_equal(afText.data, expected) and os.path.exists(path + '.f64')
+        # the sidecar is read on the second open, so changing its values shows up
+        headerSize = struct.calcsize(AudioFile.AudioFile._sidecarHeader)
+        with open(path + '.f64', 'r+b') as f:
+            f.seek(headerSize)
+            f.write(np.zeros(2).tobytes())
+        assert np.array_equal(AudioFile.AudioFile(path, sidecar = True).data[0], [0, 0])
+        # but not once the text file has a new modification time, or size
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+        assert np.array_equal(AudioFile.AudioFile(path, sidecar = True).data, expected)
+        with open(path, 'a') as f:
+            f.write('1 2\n')
+        assert np.array_equal(AudioFile.AudioFile(path, sidecar = True).data, np.vstack((expected, [1, 2])))
+        # rows with different numbers of values are not reshaped
+        with open(path, 'w') as f:
+            f.write('1 2\n3\n4 5 6\n')
+        try:
+            AudioFile.AudioFile(path)
+            assert False
+        except ValueError:
+            pass
+    finally:
+        shutil.rmtree(directory)
+    print " done"
+
+    print "   two channels ...",
+    mono = np.ravel(sf64._audiofile.data)
+    channels = np.column_stack((mono, 0.5 * mono[::-1])).astype(np.float32)
+    directory = tempfile.mkdtemp()
+    try:
+        paths = [os.path.join(directory, name) for name in ['0.raw', '1.raw']]
+        for c, path in enumerate(paths):
+            channels[:, c].tofile(path)
+        channels.tofile(os.path.join(directory, 'both.raw'))
+        writeWav(os.path.join(directory, 'both.wav'), channels.tobytes(), 3, 32, 2, 48000)
+        for af in [AudioFile.AudioFile(os.path.join(directory, 'both.raw'), channels = 2),
+                   AudioFile.AudioFile(os.path.join(directory, 'both.wav'), mmap = True)]:
+            assert af.channels == 2 and np.array_equal(af.data, channels)
+            sfBoth = SpeechFeatures(af)
+            for c, path in enumerate(paths):
+                sfMono = SpeechFeatures(AudioFile.AudioFile(path))
+                assert np.array_equal(sfBoth.mfcc()[c], sfMono.mfcc())
+                assert np.array_equal(sfBoth.energy()[c], sfMono.energy())
+                assert np.array_equal(sfBoth.logEnergy()[c], sfMono.logEnergy())
+            af.clear()
+    finally:
+        shutil.rmtree(directory)
+    print " done"
+
+    print "   iterated preemphasised frames ...",
+    afIter = AudioFile.AudioFile(os.path.join('..','demo','test.raw'), dtype = np.float32)
+    afIter.preemphasise(0.9)
+    blocks = list(afIter.iterFrames(300, frameshift = 0.01))
+    assert np.array_equal(np.concatenate([framed for framed, windowed in blocks], -2), afIter.frame(0.01))
+    assert np.array_equal(np.concatenate([windowed for framed, windowed in blocks], -2), afIter.window())
+    print " done"
+
+    print "   resampling ...",
+    from scipy.signal import resample_poly
+    afResampled = AudioFile.AudioFile(os.path.join('..','demo','test.raw'))
+    samples = afResampled.data.shape[0]
+    sfResampled = SpeechFeatures(afResampled)
+    mfcc48k = sfResampled.mfcc()
+    energy48k = sfResampled.energy()
+    afResampled.resample(16000, blockSamples = 10000)
+    assert afResampled.rate == 16000 and afResampled.data.shape[0] == -(-samples // 3)
+    reference = resample_poly(np.asarray(sf64._audiofile.data, dtype = float), 1, 3)
+    assert np.allclose(afResampled.data, reference, rtol = 0, atol = 1e-14)
+    assert np.allclose(algorithms.resample(reference, 44100, 16000), resample_poly(reference, 160, 441), rtol = 0, atol = 1e-14)
+    assert afResampled.frame().shape[-1] == 400
+    # recalculated at 16kHz
+    assert np.array_equal(sfResampled.mfcc(), SpeechFeatures(afResampled).mfcc())
+    assert not np.allclose(sfResampled.mfcc(), mfcc48k)
+    assert afResampled.encoding == 'float' and afResampled.bitdepth == 64
+    # and again after resampling back, from the 16kHz data rather than the original
+    afResampled.resample(48000)
+    assert np.array_equal(sfResampled.energy(), SpeechFeatures(afResampled).energy())
+    assert not np.array_equal(sfResampled.energy(), energy48k)
+    assert not np.array_equal(sfResampled.mfcc(), mfcc48k)
+    afResampled.open(os.path.join('..','demo','test.raw')) # and after opening a file
+    assert np.array_equal(sfResampled.mfcc(), mfcc48k)
+    print " done"
+
+    print "   threaded mfcc ...",
+    assert np.array_equal(SpeechFeatures(sf64._audiofile).mfcc(workers = 4), sf64.mfcc())
+    print " done"
 
-    import time
+    print "   threaded batch after threaded mfcc ...",
+    # long enough for several blocks, so the forked workers need their own thread pools
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'long.raw')
+        np.tile(np.ravel(sf64._audiofile.data), 6).astype(np.float32).tofile(path)
+        sfLong = SpeechFeatures(AudioFile.AudioFile(path))
+        longMfcc = sfLong.mfcc(workers = 2)
+        results = SpeechFeatures.extractBatch([path] * 2, ['mfcc'], workers = 2, mfccArgs = {'workers': 2})
+        assert all(np.array_equal(result['mfcc'], longMfcc) for result in results)
+    finally:
+        shutil.rmtree(directory)
+    print " done"
 
-    print "Timing functions (seconds)"
-    m = 10
+    print "   whole file blocks ...",
+    import sys
+    mfccModule = sys.modules['algorithms.mfcc']
+    maxBytes = mfccModule._workspaceMaxBytes
+    mfccModule._workspaceMaxBytes = 1 << 20
+    try:
+        frames = sfLong._audiofile.windowFrames(0.97)
+        assert np.array_equal(algorithms.mfcc(frames, 20), algorithms.mfcc(frames, 20, blockFrames = 10**6))
+        for name in ['fft', 'spectrum', 'filtered']: # the whole file buffers are not kept
+            assert getattr(mfccModule._workspace, name, None) is None or \
+                   getattr(mfccModule._workspace, name).nbytes <= mfccModule._workspaceMaxBytes
+    finally:
+        mfccModule._workspaceMaxBytes = maxBytes
+    print " done"
 
-    start = time.clock()
-    for n in range(m):
-        sf.setAudio(af)
-        sf.energy()
-    end = time.clock()
-    print "Energy: {0:.4f}".format((end-start)/m)  
+    print "   instrumented batch ...",
+    collector = algorithms.instrument.Collector()
+    results = SpeechFeatures.extractBatch([os.path.join('..','demo','test.raw')] * 2, workers = 1, collector = collector)
+    assert np.array_equal(results[0]['mfcc'], sf64.mfcc())
+    assert set(['read', 'windowFrames', 'fft', 'filterbank', 'log', 'dct']) <= set(collector.stages)
+    assert collector.stages['read']['count'] == 2
+    assert not algorithms.instrument._collectors # nothing left registered
+    # the stages do not nest, so each array is counted once
+    collector = algorithms.instrument.Collector()
+    algorithms.instrument.addCollector(collector)
+    try:
+        afStages = AudioFile.AudioFile(os.path.join('..','demo','test.raw'))
+        afStages.preemphasise(0.97)
+        afStages.frame(0.01) # new frames, so window preemphasises them again
+        windowed = afStages.window()
+    finally:
+        algorithms.instrument.removeCollector(collector)
+    assert collector.stages['window']['bytes'] == windowed.nbytes
+    assert collector.stages['preemphasise']['count'] == 2
+    print " done"
 
-    start = time.clock()
-    for n in range(m):
-        af = AudioFile.AudioFile(os.path.join('..','demo','test.raw'))
-        af.window('hanning')
-        af.preemphasise()
-        sf.setAudio(af)
-        sf.mfcc()
-    end = time.clock()
-    print "MFCC:   {0:.4f}".format((end-start)/m)
-       
+    print "   feature cache ...",
+    import FeatureCache
+    directory = tempfile.mkdtemp()
+    try:
+        cache = FeatureCache.FeatureCache(directory)
+        for i in range(2):
+            sfCached = SpeechFeatures(AudioFile.AudioFile(os.path.join('..','demo','test.raw')), cache = cache)
+            assert np.array_equal(sfCached.mfcc(), sf64.mfcc())
+            assert np.array_equal(sfCached.logEnergy(), sf64.logEnergy())
+        assert cache.hits == 3 and cache.misses == 3
+        sfCached.mfcc(order = 13) # different settings, different key
+        assert cache.misses == 4
+        # another file opened into the same AudioFile is hashed again
+        path = os.path.join(directory, 'quiet.raw')
+        (sf64._audiofile.data / 2).tofile(path)
+        sfCached._audiofile.open(path)
+        assert np.array_equal(sfCached.mfcc(order = 12), SpeechFeatures(AudioFile.AudioFile(path)).mfcc(12))
+        assert cache.misses == 5
+        original = AudioFile.AudioFile(os.path.join('..','demo','test.raw'))
+        assert np.array_equal(SpeechFeatures(original, cache = cache).mfcc(12), SpeechFeatures(original).mfcc(12))
+    finally:
+        shutil.rmtree(directory)
+    print " done"
 
+    print "   packed utterances ...",
+    directory = tempfile.mkdtemp()
+    try:
+        files = []
+        for i, length in enumerate([48000, 100000, 20, 70000]):
+            path = os.path.join(directory, '{0}.raw'.format(i))
+            sf64._audiofile.data[i*1000:i*1000 + length].astype(np.float32).tofile(path)
+            files.append(AudioFile.AudioFile(path))
+        files[1].frame(0.01)
+        files[2].preemphasise(0.9)
+        results = SpeechFeatures.extractPacked(files, ['mfcc', 'energy', 'logEnergy'], {'order': 20})
+        for af, result in zip(files, results):
+            alone = SpeechFeatures(af)
+            assert np.array_equal(result['mfcc'], alone.mfcc(20))
+            assert np.array_equal(result['energy'], alone.energy())
+            assert np.array_equal(result['logEnergy'], alone.logEnergy())
+    finally:
+        shutil.rmtree(directory)
+    print " done"
 
+    print "   voiced mfcc ...",
+    sfVad = SpeechFeatures(AudioFile.AudioFile(os.path.join('..','demo','test.raw')))
+    voiced = sfVad.vad(hangover = 0.05)
+    assert voiced.dtype == bool and voiced.shape == sf64.logEnergy().shape
+    dropped = sfVad.voicedMfcc()
+    assert np.array_equal(dropped, sf64.mfcc()[voiced])
+    filled = sfVad.voicedMfcc(np.nan)
+    assert np.array_equal(filled[voiced], dropped) and np.isnan(filled[~voiced]).all()
+    print " done"
 
+    print "   vad on silence, speech, silence ...",
+    # 3s of a modulated harmonic signal between 3s silences, at 16kHz
+    t = np.arange(3 * 16000) / 16000.0
+    speech = 0.3 * (1 + 0.5 * np.sin(2 * np.pi * 4 * t)) * sum(np.sin(2 * np.pi * 150 * k * t) / k for k in range(1, 10))
+    signal = np.concatenate([np.zeros(t.size), speech, np.zeros(t.size)])
+    signal += 1e-3 * np.random.RandomState(0).randn(signal.size)
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'speech.raw')
+        signal.astype(np.float32).tofile(path)
+        voiced = SpeechFeatures(AudioFile.AudioFile(path, rate = 16000)).vad()
+        thirds = np.array_split(voiced, 3)
+        assert thirds[1].mean() > 0.95 # recall on the speech
+        assert thirds[0].mean() < 0.05 and thirds[2].mean() < 0.05 # false positives, mostly the hangover
+    finally:
+        shutil.rmtree(directory)
+    print " done"
 
+    print "   (see benchmarks/benchmark.py for timings)"
     print "Done"
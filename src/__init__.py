@@ -1,4 +1,4 @@
 # Import list
 
-__all__ = ['AudioFile','Features']
+__all__ = ['AudioFile','Features','OnlineFeatures','FeatureCache','FeatureWriter','Config']
 
@@ -1,4 +1,9 @@
 # imports for algorithms 
 
+import instrument
 from energy import energy 
+from frame import frame, frameCount, frameRange, packedFrames, windowedFrames, windowedBlock
 from mfcc import mfcc
+from resample import resample, Resampler
+from vad import vad
+from window import window, windowTypes, normalisations
@@ -0,0 +1,77 @@
+from collections import OrderedDict
+import threading
+
+# every cache created, so that their counters can be totalled (see instrument)
+caches = []
+
+class LRUCache(object):
+    """
+    Bounded least recently used cache
+
+    Used to share expensive setup (e.g. filter banks) between calls and
+    between objects. Values should be treated as read only since they are
+    shared by everything that asks for the same key.
+
+    Methods
+    -------
+        get:    Returns the stored value for a key, creating it if needed
+        clear:  Empties the cache and resets the counters
+        info:   Returns the hit/miss counters and sizes
+
+    Attributes
+    ----------
+        maxsize: Maximum number of entries kept
+        hits:    Number of lookups that found an entry
+        misses:  Number of lookups that had to create an entry
+    """
+
+    def __init__(self, maxsize = 32):
+        """ Constructor
+
+        Parameters
+        ----------
+        maxsize: int, optional
+            maximum number of entries kept, default 32
+        """
+        self.maxsize = int(maxsize)
+        self._lock = threading.Lock()
+        self.clear()
+        caches.append(self)
+
+    def clear(self):
+        """ Empties the cache and resets the counters """
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, create):
+        """ Returns the value stored for key
+
+        Parameters
+        ----------
+        key: hashable
+            cache key, must include everything that affects the value
+        create: callable
+            called with no arguments to make the value if it is not stored
+
+        Returns
+        -------
+        the stored (or newly created) value
+        """
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                value = self._entries.pop(key)
+                self._entries[key] = value # most recently used at the end
+                return value
+            self.misses += 1
+        value = create()
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > max(self.maxsize, 0):
+                self._entries.popitem(last = False)
+        return value
+
+    def info(self):
+        """ Returns a dictionary of the hits, misses, current size and maximum size """
+        return {'hits':self.hits, 'misses':self.misses, 'size':len(self._entries), 'maxsize':self.maxsize}
@@ -6,13 +6,14 @@ def energy(framedData):
     Parameters
     ----------
         framedData: numpy ndarray
-            data to calculate mfccs for, each row is one frame
+            data to calculate mfccs for, each row is one frame, any 
+            leading axes (e.g. channels) are kept
             
     Returns
     -------
         (ndarray, ndarray)
             energy and log energy 
     """
-    eng = np.sum(np.square(framedData), axis = 1) 
+    eng = np.sum(np.square(framedData), axis = -1) 
     logEng = np.log(eng)
     return (eng, logEng)
\ No newline at end of file
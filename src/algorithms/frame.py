@@ -0,0 +1,324 @@
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+import instrument
+
+def frame(data, frameshift, framewidth, pad = True, centred = True, dtype = None):
+    """ Break a signal down into (possibly overlapping) frames
+
+    The frames are returned as a read only strided view, no per frame copies
+    are made. If the data is not padded (and is already of the requested
+    type) the view is directly over the input data, otherwise the signal is
+    zero padded (or converted) once and the view is over the copy.
+
+    Parameters
+    ----------
+    data: numpy ndarray
+        mono signal, either a vector or a single column, or a 
+        (samples, channels) array for multi-channel signals
+    frameshift: int
+        shift between the start of each frame in data points
+    framewidth: int
+        length of each frame in data points
+    pad: boolean, optional
+        zero pad the end (or start and end if centred) so that there is a frame
+        for every frame shift in the data, default true
+    centred: boolean, optional
+        first sample is in the centre of the first frame rather than the start
+        (only relevant for padding), default true
+    dtype: numpy dtype, optional
+        data type of the frames, default float64 as frames have always been, so
+        e.g. float32 data must ask for float32 frames to keep its type. If it
+        differs from the data the signal is converted once before framing
+
+    Returns
+    -------
+    numpy ndarray
+        read only framed version of the data, each row is one frame. 
+        Multi-channel data gives (channels, frames, framewidth)
+
+    Raises
+    ------
+    ValueError: if the frame shift or width are not positive
+    """
+    frameshift, framewidth = _checkSizes(frameshift, framewidth)
+    signal, numFrames = _prepare(data, frameshift, framewidth, pad, centred, float if dtype is None else dtype)
+    return _view(signal, numFrames, frameshift, framewidth)
+
+def windowedFrames(data, frameshift, framewidth, windowFunction, alpha = None, pad = True, centred = True, out = None, dtype = None):
+    """ Frame, pre-emphasise and window a signal in a single stage
+
+    Gives the same result as framing, applying the pre-emphasis transform 
+    s_i(n) = s_i(n) - alpha * s_i(n-1) to each frame and then multiplying
+    by the window, but the only full size array written is the output. 
+    Pre-emphasis is done once on the signal rather than on the (overlapping)
+    frames, and only the first sample of each frame needs fixing afterwards.
+
+    Parameters
+    ----------
+    data: numpy ndarray
+        signal, as for frame
+    frameshift: int
+        shift between the start of each frame in data points
+    framewidth: int
+        length of each frame in data points
+    windowFunction: numpy ndarray
+        window of framewidth points
+    alpha: float, optional
+        pre-emphasis constant, default None for no pre-emphasis
+    pad: boolean, optional
+        as for frame, default true
+    centred: boolean, optional
+        as for frame, default true
+    out: numpy ndarray, optional
+        (frames, framewidth) array, or (channels, frames, framewidth) for 
+        multi-channel data, to write the result into
+    dtype: numpy dtype, optional
+        type of the result if out is not given, default is the promoted type
+        of the data and window
+
+    Returns
+    -------
+    numpy ndarray
+        pre-emphasised and windowed frames, each row is one frame, with a 
+        leading channel axis for multi-channel data
+
+    Raises
+    ------
+    ValueError: if the window or output are the wrong size
+    """
+    frameshift, framewidth = _checkSizes(frameshift, framewidth)
+    signal, numFrames = _prepare(data, frameshift, framewidth, pad, centred)
+    return windowedBlock(signal, numFrames, frameshift, framewidth, windowFunction, alpha, out, dtype)
+
+def windowedBlock(signal, numFrames, frameshift, framewidth, windowFunction, alpha = None, out = None, dtype = None):
+    """ Pre-emphasise and window frames taken directly from the start of a signal
+
+    The work horse of windowedFrames without any padding: frame k is 
+    signal[k * frameshift:k * frameshift + framewidth], so the signal must
+    cover all numFrames frames. Useful when the caller manages the signal
+    buffer itself (e.g. when streaming).
+
+    Parameters
+    ----------
+    signal: numpy ndarray
+        signal vector, or (samples, channels) array
+    numFrames: int
+        number of frames to make
+    frameshift, framewidth, windowFunction, alpha, out, dtype
+        as for windowedFrames
+
+    Returns
+    -------
+    numpy ndarray
+        pre-emphasised and windowed frames, each row is one frame
+
+    Raises
+    ------
+    ValueError: if the signal is too short or the window or output are the wrong size
+    """
+    frameshift, framewidth = _checkSizes(frameshift, framewidth)
+    numFrames = int(numFrames)
+    signal = _signal(signal)
+    windowFunction = np.ravel(windowFunction)
+    if windowFunction.size != framewidth:
+        raise ValueError('window function must be the same length as the frames')
+    if numFrames > 0 and signal.shape[0] < (numFrames - 1) * frameshift + framewidth:
+        raise ValueError('signal is too short for {0} frames'.format(numFrames))
+
+    shape = _shape(signal, numFrames, framewidth)
+    if out is None:
+        if dtype is None:
+            dtype = np.result_type(signal.dtype, windowFunction.dtype)
+        out = np.empty(shape, dtype = dtype)
+        instrument.allocated(out.nbytes)
+    elif out.shape != shape:
+        raise ValueError('output must be {0}'.format(shape))
+
+    if alpha is None:
+        np.multiply(_view(signal, numFrames, frameshift, framewidth), windowFunction, out = out)
+        return out
+
+    source = signal.astype(out.dtype, copy = False)
+    emphasised = np.empty_like(source)
+    instrument.allocated(emphasised.nbytes + (0 if source is signal else source.nbytes))
+    emphasised[:1] = source[:1]
+    np.multiply(source[:-1], -float(alpha), out = emphasised[1:])
+    emphasised[1:] += source[1:]
+    np.multiply(_view(emphasised, numFrames, frameshift, framewidth), windowFunction, out = out)
+    # the first sample of a frame has nothing before it in the frame
+    np.multiply(_view(source, numFrames, frameshift, framewidth)[..., 0], windowFunction[0], out = out[..., 0])
+    return out
+
+def packedFrames(signals, frameshift, framewidth, windowFunction, alpha = None, pad = True, centred = True, dtype = None):
+    """ Frame, pre-emphasise and window several signals into one packed array
+
+    The frames of each signal are written one after the other into a single
+    array, so that later stages (e.g. energy and mfcc) can be run once over
+    all of them rather than once per signal. Frames of signal i are rows
+    offsets[i] to offsets[i + 1], and np.split(result, offsets[1:-1], axis)
+    splits a framewise result back into views for each signal. Each block of
+    rows is exactly windowedFrames of its own signal and settings.
+
+    Parameters
+    ----------
+    signals: list of numpy ndarray
+        signals, as for frame, multi-channel signals must all have the same number of channels
+    frameshift, windowFunction, alpha, pad, centred
+        as for windowedFrames, either one value for every signal or a list with one per signal
+    framewidth: int
+        length of each frame in data points, the same for every signal
+    dtype: numpy dtype, optional
+        type of the result, default is the promoted type of all the signals and windows
+
+    Returns
+    -------
+    numpy ndarray
+        packed frames, each row is one frame, with a leading channel axis for multi-channel signals
+    numpy ndarray
+        offsets of the first frame of each signal, with the total number of frames at the end
+
+    Raises
+    ------
+    ValueError: if the signals have different numbers of channels, a list of settings is the
+        wrong length or a window is the wrong size
+    """
+    signals = [_signal(signal) for signal in signals]
+    frameshifts = _perSignal(frameshift, len(signals), 'frameshift')
+    windows = _perSignal(windowFunction, len(signals), 'windowFunction')
+    alphas = _perSignal(alpha, len(signals), 'alpha')
+    pads = _perSignal(pad, len(signals), 'pad')
+    centreds = _perSignal(centred, len(signals), 'centred')
+    frameshifts = [_checkSizes(shift, framewidth)[0] for shift in frameshifts]
+    framewidth = int(framewidth)
+    channels = set(signal.shape[1:] for signal in signals)
+    if len(channels) > 1:
+        raise ValueError('packed signals must all have the same number of channels')
+    counts = [frameCount(signal.shape[0], shift, framewidth, pad)
+              for signal, shift, pad in zip(signals, frameshifts, pads)]
+    offsets = np.zeros(len(signals) + 1, dtype = int)
+    np.cumsum(counts, out = offsets[1:])
+    if dtype is None:
+        dtype = np.result_type(*([np.asarray(window).dtype for window in windows] + 
+                                 [signal.dtype for signal in signals]))
+
+    packed = np.empty(channels.pop() + (offsets[-1], framewidth) if signals else (0, framewidth), dtype = dtype)
+    instrument.allocated(packed.nbytes)
+    for i, signal in enumerate(signals):
+        signal, numFrames = _prepare(signal, frameshifts[i], framewidth, pads[i], centreds[i])
+        windowedBlock(signal, numFrames, frameshifts[i], framewidth, windows[i], alphas[i],
+                      packed[..., offsets[i]:offsets[i + 1], :])
+    return packed, offsets
+
+def frameRange(data, frameshift, framewidth, first, count, pad = True, centred = True, dtype = None):
+    """ Get a contiguous range of the frames produced by frame
+
+    Only the part of the signal covered by the requested frames is touched,
+    so this can be used to work through long (e.g. memory mapped) signals
+    in blocks. Frames that lie entirely within the data are a read only view
+    over it, otherwise the covered region is zero padded into a new buffer.
+
+    Parameters
+    ----------
+    data: numpy ndarray
+        signal, as for frame
+    frameshift: int
+        shift between the start of each frame in data points
+    framewidth: int
+        length of each frame in data points
+    first: int
+        index of the first frame to return
+    count: int
+        number of frames to return, fewer are returned at the end of the data
+    pad: boolean, optional
+        as for frame, default true
+    centred: boolean, optional
+        as for frame, default true
+    dtype: numpy dtype, optional
+        as for frame, default float64
+
+    Returns
+    -------
+    numpy ndarray
+        read only frames first to first + count of frame(data, ...), each row is one frame
+    """
+    frameshift, framewidth = _checkSizes(frameshift, framewidth)
+    signal = _signal(data)
+    numFrames = frameCount(signal.shape[0], frameshift, framewidth, pad)
+    dtype = np.dtype(float if dtype is None else dtype)
+    first = max(0, min(int(first), numFrames))
+    count = max(0, min(int(count), numFrames - first))
+
+    offset = framewidth // 2 if (pad and centred) else 0
+    start = first * frameshift - offset
+    stop = start + max(0, (count - 1) * frameshift + framewidth)
+    if start >= 0 and stop <= signal.shape[0]:
+        block = signal[start:stop].astype(dtype, copy = False)
+    else:
+        block = np.zeros((stop - start,) + signal.shape[1:], dtype = dtype)
+        instrument.allocated(block.nbytes)
+        lo = max(start, 0); hi = min(stop, signal.shape[0])
+        if hi > lo:
+            block[lo-start:hi-start] = signal[lo:hi]
+
+    return _view(block, count, frameshift, framewidth)
+
+def frameCount(length, frameshift, framewidth, pad = True):
+    """ Number of frames a signal of the given length (in data points) breaks down into """
+    if pad:
+        return (length + frameshift - 1) // frameshift
+    return max(0, (length - framewidth + frameshift - 1) // frameshift)
+
+def _perSignal(value, count, name):
+    """ A list of value for each of count signals, or value itself if it is already a list of count values """
+    if isinstance(value, (list, tuple)):
+        if len(value) != count:
+            raise ValueError('{0} must be one value or one for each of the {1} signals'.format(name, count))
+        return list(value)
+    return [value] * count
+
+def _checkSizes(frameshift, framewidth):
+    """ Frame shift and width as positive integers """
+    frameshift = int(frameshift)
+    framewidth = int(framewidth)
+    if frameshift < 1 or framewidth < 1:
+        raise ValueError('frame shift and width must be at least one data point')
+    return frameshift, framewidth
+
+def _prepare(data, frameshift, framewidth, pad, centred, dtype = None):
+    """ The (padded) signal vector the frames are a view of and the number of frames """
+    signal = _signal(data)
+    numFrames = frameCount(signal.shape[0], frameshift, framewidth, pad)
+    dtype = signal.dtype if dtype is None else np.dtype(dtype)
+
+    if pad:
+        offset = framewidth // 2 if centred else 0
+        padded = np.zeros((max(0, (numFrames - 1) * frameshift + framewidth),) + signal.shape[1:], dtype = dtype)
+        copyLen = max(0, min(signal.shape[0], padded.shape[0] - offset))
+        padded[offset:offset+copyLen] = signal[:copyLen]
+        signal = padded
+    elif signal.dtype != dtype:
+        signal = signal.astype(dtype)
+    else:
+        return signal, numFrames
+    instrument.allocated(signal.nbytes)
+    return signal, numFrames
+
+def _signal(data):
+    """ The data as a vector if it is mono, otherwise as (samples, channels) """
+    data = np.asarray(data)
+    if data.ndim == 2 and data.shape[1] > 1:
+        return data
+    return np.ravel(data)
+
+def _shape(signal, numFrames, framewidth):
+    """ Shape of the frames of a signal, with a leading channel axis if it is multi-channel """
+    return signal.shape[1:] + (numFrames, framewidth)
+
+def _view(signal, numFrames, frameshift, framewidth):
+    """ Read only view of a signal vector (or the channels of a 2D signal) as frames """
+    step = signal.strides[0]
+    framed = as_strided(signal, shape = _shape(signal, numFrames, framewidth), 
+                        strides = signal.strides[1:] + (frameshift * step, step))
+    framed.flags.writeable = False
+    return framed
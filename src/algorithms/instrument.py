@@ -0,0 +1,156 @@
+import threading
+import time
+
+import cache
+
+# callables given an event dictionary at the end of every stage, see addCollector
+_collectors = []
+# per thread stack of the stages currently running
+_active = threading.local()
+
+try:
+    _cpu = time.process_time
+except AttributeError:
+    _cpu = time.clock # python 2, processor time on unix
+
+def addCollector(collector):
+    """ Registers a callable to receive the events of every stage
+
+    Each event is a dictionary with the keys
+        stage:       name of the stage (read, resample, frame, window, preemphasise,
+                     windowFrames, energy, vad, fft, filterbank, log, dct)
+        wall:        wall clock time in seconds
+        cpu:         processor time of the whole process in seconds (so it
+                     includes other threads, e.g. with mfcc workers)
+        bytes:       bytes allocated for arrays by the stage
+        cacheHits:   window and filter bank cache hits during the stage
+        cacheMisses: window and filter bank cache misses during the stage
+    Stages do not overlap so the times can be added up. While nothing is
+    registered the stages cost (almost) nothing.
+
+    Parameters
+    ----------
+    collector: callable
+        called with each event, e.g. a Collector
+    """
+    _collectors.append(collector)
+
+def removeCollector(collector):
+    """ Stops a registered callable receiving events """
+    _collectors.remove(collector)
+
+def stage(name):
+    """ Context manager that reports the time, allocations and cache use of the code it wraps """
+    if not _collectors:
+        return _noStage
+    return _Stage(name)
+
+def allocated(nbytes):
+    """ Records that nbytes were allocated by the stages currently running """
+    if _collectors:
+        for running in getattr(_active, 'stack', ()):
+            running.bytes += int(nbytes)
+
+
+class Collector(object):
+    """
+    Aggregates stage events
+
+    Keeps the totals of each stage so that they can be looked at after a
+    run, or merged together from several runs (e.g. the workers of a batch).
+
+    Methods
+    -------
+        merge:   Adds the totals of another collector (or its totals dictionary)
+        totals:  Returns the totals of each stage
+        report:  Returns the totals as a printable table
+
+    Attributes
+    ----------
+        stages: stage name to a dictionary of count, wall, cpu, bytes, cacheHits and cacheMisses
+    """
+
+    fields = ['count', 'wall', 'cpu', 'bytes', 'cacheHits', 'cacheMisses']
+
+    def __init__(self):
+        """ Constructor """
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        """ Adds an event to the totals, events can come from several threads """
+        with self._lock:
+            totals = self._stage(event['stage'])
+            totals['count'] += 1
+            for field in self.fields[1:]:
+                totals[field] += event[field]
+
+    def merge(self, other):
+        """ Adds the totals of a Collector or a dictionary from totals() """
+        stages = other.stages if isinstance(other, Collector) else other
+        for name, other in stages.items():
+            totals = self._stage(name)
+            for field in self.fields:
+                totals[field] += other[field]
+
+    def totals(self):
+        """ Returns a copy of the totals of each stage """
+        return dict((name, dict(totals)) for name, totals in self.stages.items())
+
+    def report(self):
+        """ Returns the totals as a table, slowest stage first """
+        lines = ['{0:<14} {1:>8} {2:>10} {3:>10} {4:>12} {5:>8} {6:>8}'.format(
+                 'stage', 'count', 'wall (s)', 'cpu (s)', 'MB', 'hits', 'misses')]
+        for name, t in sorted(self.stages.items(), key = lambda item: -item[1]['wall']):
+            lines.append('{0:<14} {1:>8} {2:>10.4f} {3:>10.4f} {4:>12.2f} {5:>8} {6:>8}'.format(
+                         name, t['count'], t['wall'], t['cpu'], t['bytes'] / 1e6, t['cacheHits'], t['cacheMisses']))
+        return '\n'.join(lines)
+
+    def _stage(self, name):
+        """ The totals of a stage, created if needed """
+        if name not in self.stages:
+            self.stages[name] = dict((field, 0) for field in self.fields)
+        return self.stages[name]
+
+
+class _NoStage(object):
+    """ Stage used while nothing is collecting """
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+
+_noStage = _NoStage()
+
+
+class _Stage(object):
+    """ A running stage """
+
+    def __init__(self, name):
+        self.name = name
+        self.bytes = 0
+
+    def __enter__(self):
+        if not hasattr(_active, 'stack'):
+            _active.stack = []
+        _active.stack.append(self)
+        self._hits, self._misses = _cacheCounts()
+        self._cpu = _cpu()
+        self._wall = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.time() - self._wall
+        cpu = _cpu() - self._cpu
+        hits, misses = _cacheCounts()
+        _active.stack.remove(self)
+        event = {'stage':self.name, 'wall':wall, 'cpu':cpu, 'bytes':self.bytes,
+                 'cacheHits':hits - self._hits, 'cacheMisses':misses - self._misses}
+        for collector in list(_collectors):
+            collector(event)
+        return False
+
+
+def _cacheCounts():
+    """ Total hits and misses of every cache """
+    return sum(c.hits for c in cache.caches), sum(c.misses for c in cache.caches)
@@ -1,18 +1,42 @@
 # -*- coding: utf-8 -*-
 
-from scipy.fftpack import fft as FFT
-from scipy.fftpack import dct as DCT
+# scipy.fftpack is slow to import so it is only imported when it is first used
+from multiprocessing.pool import ThreadPool
+import atexit
 import numpy as np
+import os
+import threading
 
-def mfcc(framewiseData, order = 60, samplerate = 48000, fftLen = None, low = 0, high = None): 
+from cache import LRUCache
+import instrument
+
+# filter banks shared between calls, see filterBank
+filterBankCache = LRUCache(32)
+
+# per thread buffers reused between calls, see _buffer, larger buffers are not kept
+_workspace = threading.local()
+_workspaceMaxBytes = 1 << 26
+
+# thread pool kept for the workers option of mfcc as (process id, threads, pool), see _threadPool
+_threadPoolState = [None, None, None]
+_threadPoolLock = threading.Lock()
+
+def mfcc(framewiseData, order = 60, samplerate = 48000, fftLen = None, low = 0, high = None, fastLen = False,
+         workers = None, blockFrames = 1024): 
     """ Get the mel-frequency cepstral coefficients for the give data 
     
-    Calculates the MFCCs of the data, it is assumed that the data is unbiased and pre-emphasised
+    Calculates the MFCCs of the data, it is assumed that the data is unbiased and pre-emphasised.
+    float32 data is kept in float32 throughout, anything else is calculated in float64.
+    The frames are processed in blocks of blockFrames rows, which keeps the working
+    arrays small and lets the blocks be shared out over threads (the FFT, filter 
+    bank, log and DCT all release the GIL). Each row only depends on its own frame
+    so the result is identical for any number of workers
   
     Parameters
     ----------
     framewiseData: numpy ndarray
-        data to calculate mfccs for, each row is one frame
+        data to calculate mfccs for, each row is one frame, any leading 
+        axes (e.g. channels) are kept and the frames are batched together
     order: int, optional 
         number of MFCCs to calculate, default 60
     samplerate: float, optional
@@ -23,6 +47,12 @@ def mfcc(framewiseData, order = 60, samplerate = 48000, fftLen = None, low = 0,
         lowest frequency for fft bins in Hz, default 0
     high: float, optional
         highest frequency for fft bins in Hz, default samplerate / 2 
+    fastLen: boolean, optional
+        zero pad the FFT up to the next length that is fast to compute, default false
+    workers: int, optional
+        number of threads to share the blocks between, default None for the calling thread only
+    blockFrames: int, optional
+        number of frames in each block, default 1024
         
         
     Returns
@@ -41,36 +71,240 @@ def mfcc(framewiseData, order = 60, samplerate = 48000, fftLen = None, low = 0,
         high = samplerate / 2 # niquest
     high = float(high)    
   
+    shape = framewiseData.shape
+    framewiseData = framewiseData.reshape((-1, shape[-1]))
     if fftLen is None: 
-        fftLen = framewiseData.shape[1]
+        fftLen = shape[-1]
     if float(fftLen).is_integer():     
         fftLen = int(fftLen)
     else:
         raise ValueError('FFT Length is not an integer')  
+    if fastLen:
+        from scipy.fftpack import next_fast_len
+        fftLen = next_fast_len(fftLen)
+    blockFrames = int(blockFrames)
+    if blockFrames < 1:
+        raise ValueError('mfcc needs at least one frame per block')
+    workers = 1 if workers is None else max(1, int(workers))
+    dtype = _floatType(framewiseData)
+    frames = framewiseData.shape[0]
+    if frames == 0:
+        return np.zeros(shape[:-1] + (int(order),), dtype = dtype)
+
+    with instrument.stage('filterbank'):
+        filters = bandedFilterBank(order, low, high, fftLen, samplerate, dtype)
+        mfccs = np.empty((frames, len(filters.weights)), dtype = dtype)
+        instrument.allocated(mfccs.nbytes)
+
+    def block(start):
+        stop = min(start + blockFrames, frames)
+        _mfccBlock(framewiseData[start:stop], fftLen, filters, mfccs[start:stop])
+    starts = range(0, frames, blockFrames)
+    if workers == 1 or len(starts) == 1:
+        for start in starts:
+            block(start)
+    else:
+        _threadPool(workers).map(block, starts)
+    return mfccs.reshape(shape[:-1] + mfccs.shape[-1:])
 
-    spectrum = powerSpectrum(framewiseData, fftLen)
-    filters = filterBank(order, low, high, fftLen, samplerate)
+def _mfccBlock(framewiseData, fftLen, filters, out):
+    """ MFCCs of a block of frames written into out, uses the per thread buffers """
+    from scipy.fftpack import dct as DCT
+    dtype = out.dtype
+    # the spectrum is only needed until the filters are applied so reuse its buffer
+    with instrument.stage('fft'):
+        spectrum = powerSpectrum(framewiseData, fftLen, 
+                                 out = _buffer('spectrum', (framewiseData.shape[0], fftLen // 2 + 1), dtype),
+                                 work = _buffer('fft', (framewiseData.shape[0], fftLen), dtype))
+    with instrument.stage('filterbank'):
+        filtered = filters.apply(spectrum, out = _buffer('filtered', out.shape, dtype))
     # TODO: apply lifter
-    mfccs = np.log(np.dot(spectrum, filters))
-    mfccs = DCT(mfccs, type=2, norm='ortho')
-    return mfccs
+    with instrument.stage('log'):
+        np.log(filtered, out = filtered)
+    with instrument.stage('dct'):
+        out[...] = DCT(filtered, type=2, norm='ortho', overwrite_x = True)
+
+def filterBank(order, low, high, fftLen, samplerate, dtype = float):
+    """ Get a triangular window filter bank 
+    
+    Filter banks are cached on (order, low, high, fftLen, samplerate, dtype)
+    in filterBankCache, the returned bank is shared so it is read only
+    
+    Returns
+    -------
+    numpy ndarray
+        filter bank, (fftLen/2 + 1, order) one column per filter, one row per one sided FFT bin
+    """
+    key = (int(order), float(low), float(high), int(fftLen), float(samplerate), np.dtype(dtype))
+    return filterBankCache.get(key, lambda: _makeFilterBank(*key))
+
+def bandedFilterBank(order, low, high, fftLen, samplerate, dtype = float):
+    """ Get a triangular window filter bank in banded form 
+    
+    The same filters as filterBank but only the non zero weights are kept, 
+    see BandedFilterBank. Cached alongside the dense banks in filterBankCache
+    
+    Returns
+    -------
+    BandedFilterBank
+        the filter bank
+    """
+    key = (int(order), float(low), float(high), int(fftLen), float(samplerate), np.dtype(dtype))
+    return filterBankCache.get(key + ('banded',), lambda: BandedFilterBank(filterBank(*key)))
+
+class BandedFilterBank(object):
+    """
+    Compact filter bank
+    
+    Each triangular filter only covers a few FFT bins, so rather than a dense
+    (bins, order) matrix only the first and last bin and the weights in 
+    between are kept for each filter. Applying the bank then only touches 
+    the non zero bins. Shared through the cache so should be treated as read only.
+    
+    Methods
+    -------
+        apply:  Applies the filters to a spectrum
+        dense:  Returns the equivalent dense filter bank
+    
+    Attributes
+    ----------
+        bins:    Number of FFT bins the bank applies to
+        starts:  First bin of each filter
+        stops:   One after the last bin of each filter
+        weights: List of the weights of each filter from start to stop
+    """
+    
+    def __init__(self, bank):
+        """ Constructor 
+        
+        Parameters
+        ----------
+        bank: numpy ndarray
+            dense (bins, order) filter bank, one column per filter
+        """
+        self.bins = bank.shape[0]
+        self.starts = np.zeros(bank.shape[1], dtype = int)
+        self.stops = np.zeros(bank.shape[1], dtype = int)
+        self.weights = []
+        for o in range(bank.shape[1]):
+            nonZero = np.flatnonzero(bank[:, o])
+            if nonZero.size:
+                self.starts[o] = nonZero[0]
+                self.stops[o] = nonZero[-1] + 1
+            weights = np.array(bank[self.starts[o]:self.stops[o], o])
+            weights.flags.writeable = False
+            self.weights.append(weights)
+        self.starts.flags.writeable = False
+        self.stops.flags.writeable = False
+        self._dtype = bank.dtype
+    
+    def apply(self, spectrum, out = None):
+        """ Applies the filters to a spectrum, the same as np.dot(spectrum, self.dense())
+        
+        Each row is summed on its own (einsum rather than a BLAS product, 
+        whose rounding depends on where the row falls in the block), so a 
+        frame gives exactly the same result however the frames are batched
+        
+        Parameters
+        ----------
+        spectrum: numpy ndarray
+            one sided spectrum, (frames, bins)
+        out: numpy ndarray, optional
+            (frames, order) array to write the result into
+            
+        Returns
+        -------
+        numpy ndarray
+            filter outputs, (frames, order) 
+            
+        Raises
+        ------
+        ValueError: if the spectrum does not have the right number of bins
+        """
+        if spectrum.shape[-1] != self.bins:
+            raise ValueError('Spectrum has {0} bins, filter bank expects {1}'.format(spectrum.shape[-1], self.bins))
+        if out is None:
+            out = np.empty(spectrum.shape[:-1] + (len(self.weights),), dtype = np.result_type(spectrum.dtype, self._dtype))
+        for o, weights in enumerate(self.weights):
+            np.einsum('...j,j->...', spectrum[..., self.starts[o]:self.stops[o]], weights, out = out[..., o])
+        return out
+        
+    def dense(self):
+        """ Returns the equivalent dense (bins, order) filter bank """
+        bank = np.zeros((self.bins, len(self.weights)), dtype = self._dtype)
+        for o, weights in enumerate(self.weights):
+            bank[self.starts[o]:self.stops[o], o] = weights
+        return bank
 
-def filterBank(order, low, high, fftLen, samplerate):
+def _makeFilterBank(order, low, high, fftLen, samplerate, dtype):
     """ Create a triangular window filter bank """
     centrePoints = fromMel(np.linspace(toMel(low), toMel(high), order + 2))
-    centrePoints = np.round(fftLen*centrePoints/samplerate)
+    centrePoints = np.round(fftLen*centrePoints/samplerate).astype(int)
+    start = centrePoints[:-2, np.newaxis]
+    centre = centrePoints[1:-1, np.newaxis]
+    stop = centrePoints[2:, np.newaxis]
   
-    bank = np.zeros((order, fftLen/2))
-    for o in range(order):
-        bank[o, centrePoints[o]:centrePoints[o+1]] = np.linspace(0, 1.0, centrePoints[o+1] - centrePoints[o] + 1)[1:]
-        bank[o, centrePoints[o+1]:centrePoints[o+2]] = np.linspace(1.0, 0.0, centrePoints[o+2] - centrePoints[o+1] + 1)[:-1]
-      
-    return bank.T
+    # rising edge reaches 1 at the centre bin, falling edge reaches 0 at the stop bin
+    bins = np.arange(fftLen // 2 + 1)[np.newaxis, :]
+    rising = (bins - start + 1.0) / np.maximum(centre - start, 1)
+    falling = 1.0 - (bins - centre) / np.maximum(stop - centre, 1).astype(float)
+    bank = np.where((bins >= start) & (bins < centre), rising, 0.0)
+    bank = np.where((bins >= centre) & (bins < stop), falling, bank)
+    
+    bank = np.ascontiguousarray(bank.T, dtype = dtype)
+    bank.flags.writeable = False
+    return bank
   
-def powerSpectrum(data, fftLen):
-    """ Calculate the framewise one tail power spectrum """
-    fftLen = int(fftLen)  
-    return np.absolute(FFT(data,axis=1,n=fftLen)[:,fftLen/2:])  
+def powerSpectrum(data, fftLen, power = False, out = None, work = None):
+    """ Calculate the framewise one tail magnitude (or power) spectrum 
+    
+    Uses a real input FFT so only bins 0 to fftLen/2 are computed
+    
+    Parameters
+    ----------
+    data: numpy ndarray
+        real data, each row is one frame
+    fftLen: int
+        length of the FFT, frames are truncated or zero padded to this length
+    power: boolean, optional
+        return the power rather than the magnitude, default false
+    out: numpy ndarray, optional
+        (frames, fftLen/2 + 1) array to write the spectrum into
+    work: numpy ndarray, optional
+        (frames, fftLen) array the FFT is done in, overwritten, default a new array
+        
+    Returns
+    -------
+    numpy ndarray
+        spectrum, each row is one frame, each column is one bin from 0Hz to samplerate / 2
+    """
+    fftLen = int(fftLen)
+    frames = data.shape[0]
+    dtype = _floatType(data)
+    if out is None:
+        out = np.empty((frames, fftLen // 2 + 1), dtype = dtype)
+        instrument.allocated(out.nbytes)
+    if frames == 0:
+        return out
+    
+    from scipy.fftpack import rfft as RFFT
+    if work is None:
+        work = np.empty((frames, fftLen), dtype = dtype)
+        instrument.allocated(work.nbytes)
+    n = min(fftLen, data.shape[1])
+    work[:, :n] = data[:, :n]
+    work[:, n:] = 0
+    # packed as [r0, r1, i1, r2, i2, ...] with a final real value for even lengths
+    packed = RFFT(work, axis = 1, overwrite_x = True)
+    
+    pairs = (fftLen - 1) // 2
+    np.absolute(packed[:, 0], out = out[:, 0])
+    np.hypot(packed[:, 1:2*pairs:2], packed[:, 2:2*pairs+1:2], out = out[:, 1:pairs+1])
+    if fftLen % 2 == 0:
+        np.absolute(packed[:, -1], out = out[:, -1])
+    if power:
+        np.square(out, out = out)
+    return out
   
 def toMel(x):
     """ Converts x from Hz to mel-scale """  
@@ -78,4 +312,49 @@ def toMel(x):
 
 def fromMel(x):
     """ Converts x from mel-scale to Hz """  
-    return 700*(10**(x/2595.0)-1)  
+    return 700*(10**(x/2595.0)-1)
+
+def _floatType(data):
+    """ Floating point type calculations on data are done in """
+    return np.float32 if data.dtype == np.float32 else np.float64
+
+def _threadPool(workers):
+    """ A thread pool with the given number of threads, shared between calls 
+    
+    Only one pool is kept, it is closed when a different number of threads
+    is asked for. A forked process inherits the pool but not its threads,
+    so a new pool is made whenever the process id changes
+    """
+    global _threadPoolLock
+    pid = os.getpid()
+    if _threadPoolState[0] != pid:
+        # the lock may have been copied while another thread held it
+        _threadPoolLock = threading.Lock()
+        _threadPoolState[:] = [pid, None, None]
+    with _threadPoolLock:
+        if _threadPoolState[1] != workers:
+            _closeThreadPool()
+            _threadPoolState[1:] = [workers, ThreadPool(workers)]
+        return _threadPoolState[2]
+
+def _closeThreadPool():
+    """ Closes the thread pool of this process, if it has one """
+    if _threadPoolState[0] == os.getpid() and _threadPoolState[2] is not None:
+        _threadPoolState[2].close()
+        _threadPoolState[2].join()
+    _threadPoolState[1:] = [None, None]
+
+atexit.register(_closeThreadPool)
+
+def _buffer(name, shape, dtype):
+    """ Returns a per thread buffer that is reused while the shape and type stay the same
+
+    Buffers over _workspaceMaxBytes are not kept, so a large block (e.g. blockFrames
+    set to the whole file) does not hold on to its memory after the call
+    """
+    buf = getattr(_workspace, name, None)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+        buf = np.empty(shape, dtype = dtype)
+        instrument.allocated(buf.nbytes)
+        setattr(_workspace, name, buf if buf.nbytes <= _workspaceMaxBytes else None)
+    return buf
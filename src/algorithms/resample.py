@@ -0,0 +1,238 @@
+from fractions import Fraction
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from cache import LRUCache
+import instrument
+
+# polyphase filters shared between calls, see resampleFilter
+resampleFilterCache = LRUCache(16)
+
+def resample(data, rate, targetRate, blockSamples = 1 << 20, dtype = None):
+    """ Resample a signal to a new sampling rate
+
+    Rational ratio polyphase resampling (see Resampler), the signal is
+    worked through blockSamples at a time so only the result is the size
+    of the signal, e.g. a memory mapped input is never read in full.
+
+    Parameters
+    ----------
+    data: numpy ndarray
+        signal vector, or (samples, channels) array
+    rate: float
+        sampling rate of the data in Hz
+    targetRate: float
+        sampling rate to resample to in Hz
+    blockSamples: int, optional
+        input samples processed at a time, default 2**20
+    dtype: numpy dtype, optional
+        floating point type of the calculations and the result, default float64
+
+    Returns
+    -------
+    numpy ndarray
+        resampled signal, the same number of dimensions as data
+
+    Raises
+    ------
+    ValueError: if a rate is not positive or the ratio is too complex
+    """
+    data = np.asarray(data)
+    blockSamples = max(1, int(blockSamples))
+    resampler = Resampler(rate, targetRate, data.shape[1] if data.ndim == 2 else 1, dtype)
+    out = np.empty((resampler.outputLength(data.shape[0]),) + data.shape[1:], dtype = resampler.dtype)
+    instrument.allocated(out.nbytes)
+    done = 0
+    for start in range(0, data.shape[0] + blockSamples, blockSamples):
+        if start < data.shape[0]:
+            block = resampler.push(data[start:start + blockSamples])
+        else:
+            block = resampler.flush()
+        out[done:done + block.shape[0]] = block
+        done += block.shape[0]
+    return out
+
+def ratio(rate, targetRate):
+    """ The resampling ratio as the smallest integers (up, down) with targetRate / rate = up / down """
+    if rate <= 0 or targetRate <= 0:
+        raise ValueError('sampling rates must be positive')
+    fraction = Fraction(targetRate) / Fraction(rate)
+    return fraction.numerator, fraction.denominator
+
+def resampleFilter(up, down, dtype = float):
+    """ Get the polyphase low pass filter for resampling by up / down
+
+    A Kaiser windowed (beta 5) sinc with its cut off at the lower of the two
+    Nyquist frequencies and 10 zero crossings each side, the same design as
+    scipy.signal.resample_poly. Filters are cached on (up, down, dtype) in
+    resampleFilterCache, the returned filter is shared so it is read only.
+
+    Returns
+    -------
+    numpy ndarray
+        (up, taps) one row per phase, time reversed so row r applied to
+        x[n - taps + 1:n + 1] gives the output of phase r ending at x[n]
+    int
+        half length of the full filter, its delay in upsampled points
+    """
+    key = (int(up), int(down), np.dtype(dtype))
+    return resampleFilterCache.get(key, lambda: _makeResampleFilter(*key))
+
+def _makeResampleFilter(up, down, dtype):
+    """ Design the polyphase filter for resampleFilter """
+    factor = max(up, down)
+    half = 10 * factor
+    n = np.arange(-half, half + 1)
+    h = np.sinc(n / float(factor)) * np.kaiser(2 * half + 1, 5.0)
+    h *= up / h.sum()
+    taps = -(-h.size // up)
+    h = np.concatenate((h, np.zeros(taps * up - h.size)))
+    phases = np.ascontiguousarray(h.reshape((taps, up)).T[:, ::-1], dtype = dtype)
+    phases.flags.writeable = False
+    return phases, half
+
+
+class Resampler(object):
+    """
+    Streaming polyphase resampler
+
+    Resamples by the rational ratio up / down = targetRate / rate. Output n
+    is the low pass filtered, up sampled signal at n * down, which only
+    needs every up-th filter tap, so each output costs taps / up multiplies
+    and nothing is computed for the zeros of the up sampled signal or the
+    outputs that down sampling would throw away. Signals can be pushed in
+    chunks of any size, the outputs are the same as resampling the whole
+    signal at once (and as scipy.signal.resample_poly, to rounding).
+
+    Methods
+    -------
+        reset:        Forgets the signal so far
+        push:         Adds samples and returns the outputs they complete
+        flush:        Zero pads the end of the signal and returns the remaining outputs
+        outputLength: Number of outputs for a signal of a given length
+
+    Attributes (should be treated as read only)
+    ----------
+        up:       Up sampling factor
+        down:     Down sampling factor
+        channels: Number of channels
+        dtype:    Floating point type of the calculations and outputs
+
+
+    Private methods and attributes
+    ------------------------------
+        _phases:     Polyphase filter, see resampleFilter
+        _half:       Delay of the filter in up sampled points
+        _buffer:     Samples still needed, (channels, samples) so each channel is contiguous
+        _start:      Index in the signal of the first sample in the buffer
+        _received:   Number of samples pushed
+        _produced:   Number of outputs returned
+        _vector:     Were the samples pushed as a vector
+        _produce(n): Outputs of the next n samples
+    """
+
+    def __init__(self, rate, targetRate, channels = 1, dtype = None):
+        """ Constructor
+
+        Parameters
+        ----------
+        rate: float
+            sampling rate of the input in Hz
+        targetRate: float
+            sampling rate of the output in Hz
+        channels: int, optional
+            number of channels, default 1
+        dtype: numpy dtype, optional
+            floating point type of the calculations, float32 or float64 (the default)
+
+        Raises
+        ------
+        ValueError: if a rate is not positive or the ratio is too complex
+        """
+        self.up, self.down = ratio(rate, targetRate)
+        if max(self.up, self.down) > 1000:
+            raise ValueError('resampling ratio {0}/{1} is too complex'.format(self.up, self.down))
+        self.channels = int(channels)
+        self.dtype = np.dtype(np.float32 if dtype is not None and np.dtype(dtype) == np.float32 else np.float64)
+        self._phases, self._half = resampleFilter(self.up, self.down, self.dtype)
+        self.reset()
+
+    def reset(self):
+        """ Forgets the signal so far, ready for a new one """
+        self._received = 0
+        self._produced = 0
+        self._vector = self.channels == 1
+        # the signal starts with zeros for the filter to run into
+        taps = self._phases.shape[1]
+        self._start = 1 - taps
+        self._buffer = np.zeros((self.channels, taps - 1), dtype = self.dtype)
+
+    def outputLength(self, length):
+        """ Number of outputs for a signal of length samples """
+        return -(-int(length) * self.up // self.down)
+
+    def push(self, samples):
+        """ Adds samples to the signal
+
+        Parameters
+        ----------
+        samples: numpy ndarray
+            the next samples, a vector or (samples, channels)
+
+        Returns
+        -------
+        numpy ndarray
+            the outputs completed by these samples, (outputs, channels) or a vector if the input was
+        """
+        samples = np.asarray(samples)
+        self._vector = samples.ndim == 1
+        self._buffer = np.concatenate((self._buffer, samples.reshape((-1, self.channels)).T), axis = 1)
+        self._received += samples.shape[0]
+        count = max(0, (self._received * self.up - self._half - 1) // self.down + 1 - self._produced)
+        out = self._produce(count)
+        return out[:, 0] if self._vector else out
+
+    def flush(self):
+        """ Ends the signal
+
+        The signal is zero padded so every output up to outputLength is
+        produced, then the resampler is reset
+
+        Returns
+        -------
+        numpy ndarray
+            the remaining outputs, shaped like those of push
+        """
+        count = self.outputLength(self._received) - self._produced
+        if count > 0:
+            last = ((self._produced + count - 1) * self.down + self._half) // self.up
+            needed = last + 1 - self._start - self._buffer.shape[1]
+            if needed > 0:
+                self._buffer = np.concatenate((self._buffer, np.zeros((self.channels, needed), dtype = self.dtype)),
+                                              axis = 1)
+        out = self._produce(max(0, count))
+        vector = self._vector
+        self.reset()
+        return out[:, 0] if vector else out
+
+    def _produce(self, count):
+        """ Outputs of the next count samples, then drops the samples no longer needed """
+        taps = self._phases.shape[1]
+        out = np.empty((count, self.channels), dtype = self.dtype)
+        step = self._buffer.strides[1]
+        # outputs up samples apart use the same phase, and their inputs are down samples apart
+        for first in range(min(self.up, count)):
+            position = (self._produced + first) * self.down + self._half
+            phase = self._phases[position % self.up]
+            offset = position // self.up - taps + 1 - self._start
+            outputs = len(range(first, count, self.up))
+            for c in range(self.channels):
+                inputs = as_strided(self._buffer[c, offset:], shape = (outputs, taps),
+                                    strides = (self.down * step, step))
+                np.einsum('tl,l->t', inputs, phase, out = out[first::self.up, c])
+        self._produced += count
+        drop = max(0, (self._produced * self.down + self._half) // self.up - taps + 1 - self._start)
+        drop = min(drop, self._buffer.shape[1])
+        self._buffer = self._buffer[:, drop:]
+        self._start += drop
+        return out
@@ -0,0 +1,82 @@
+import numpy as np
+
+def vad(logEnergy, margin = 12.0, window = 1000, hangover = 20):
+    """ Energy based voice activity detection
+
+    A frame is voiced when its log energy is more than margin dB above the
+    noise floor. The floor only follows the quiet frames: it is the lowest
+    log energy of the unvoiced frames among the previous window frames, so
+    speech does not raise it however long it runs, while a slow rise in the
+    background level is followed through the frames within the margin. If
+    none of the previous window frames are unvoiced (the background has
+    jumped by more than the margin) the lowest of them is used instead. The
+    floor is updated every window / 10 frames, and until there are previous
+    frames it is the lowest in the first window frames. Each voiced frame
+    also marks the following hangover frames as voiced so that quiet word
+    endings and short pauses are kept.
+
+    Parameters
+    ----------
+    logEnergy: numpy ndarray
+        natural log energy of each frame (see energy), multi-channel
+        (channels, frames) log energies give a frame voiced in any channel
+    margin: float, optional
+        how far above the noise floor voiced frames are in dB, default 12
+    window: int, optional
+        number of previous frames the noise floor is taken over, default 1000
+    hangover: int, optional
+        frames kept after each voiced frame, default 20
+
+    Returns
+    -------
+    numpy ndarray
+        boolean mask, True for the voiced frames
+
+    Raises
+    ------
+    ValueError: if the window is not positive or the hangover is negative
+    """
+    window = int(window)
+    hangover = int(hangover)
+    if window < 1:
+        raise ValueError('vad needs a window of at least one frame')
+    if hangover < 0:
+        raise ValueError('vad hangover can not be negative')
+    logEnergy = np.asarray(logEnergy, dtype = float)
+    logEnergy = logEnergy.reshape((-1, logEnergy.shape[-1]))
+    frames = logEnergy.shape[-1]
+    voiced = np.zeros(frames, dtype = bool)
+    if frames == 0:
+        return voiced
+
+    # margin in dB of energy to natural log units
+    margin = float(margin) * np.log(10) / 10
+    for channel in logEnergy:
+        finite = np.isfinite(channel)
+        if not finite.any():
+            continue # digital silence
+        # silent (zero energy) frames would drag the floor to -inf
+        channel = np.where(finite, channel, channel[finite].min())
+        voiced |= _aboveFloor(channel, window, margin)
+
+    if hangover and voiced.any():
+        index = np.arange(frames)
+        lastVoiced = np.maximum.accumulate(np.where(voiced, index, -hangover - 1))
+        voiced = index - lastVoiced <= hangover
+    return voiced
+
+def _aboveFloor(x, width, margin):
+    """ Frames of x more than margin above the noise floor of the quiet frames before them, see vad """
+    step = max(1, width // 10)
+    voiced = np.empty(x.size, dtype = bool)
+    quiet = np.empty(x.size) # x for the unvoiced frames, inf for the voiced ones
+    floor = x[:width].min()
+    for start in range(0, x.size, step):
+        if start:
+            floor = quiet[max(0, start - width):start].min()
+            if not np.isfinite(floor):
+                floor = x[max(0, start - width):start].min()
+        block = slice(start, start + step)
+        np.greater(x[block], floor + margin, out = voiced[block])
+        quiet[block] = np.where(voiced[block], np.inf, x[block])
+    return voiced
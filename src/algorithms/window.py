@@ -0,0 +1,85 @@
+import numpy as np
+
+from cache import LRUCache
+
+# window functions shared between calls and AudioFile objects, see window
+windowCache = LRUCache(32)
+
+windowTypes = ['blackman', 'bartlett', 'hamming', 'hanning', 'kaiser', 'rectangular', 'trapazoid']
+normalisations = ['none', 'sum', 'square sum']
+
+def window(windowType, size, normalisation = 'square sum', kaiserBeta = None, dtype = float):
+    """ Get a window function
+
+    Windows are cached on (windowType, size, normalisation, kaiserBeta, dtype)
+    in windowCache, the returned window is shared so it is read only
+
+    Parameters
+    ----------
+    windowType: {'blackman', 'bartlett', 'hamming', 'hanning', 'kaiser', 'rectangular', 'trapazoid'}
+        the window type, if kaiser then the beta parameter must also be given
+    size: int
+        length of the window in data points
+    normalisation: {'none', 'sum', 'square sum'}, optional
+        if 'sum' then the window sums to one, if 'square sum' then its elementwise
+        square sums to one, default 'square sum'
+    kaiserBeta: float, optional
+        beta parameter for the kaiser window
+    dtype: numpy dtype, optional
+        data type of the window, default float
+
+    Returns
+    -------
+    numpy ndarray
+        the window as a single row
+
+    Raises
+    ------
+    ValueError if window type or normalisation type not recognised
+    ValueError if kaiser is specified and no beta is provided
+    """
+    size = int(size)
+    if windowType not in windowTypes:
+        raise ValueError('Unknown window function: {0}'.format(windowType))
+    if normalisation not in normalisations:
+        raise ValueError('Unknown normalisation: {0}'.format(normalisation))
+    if windowType == 'kaiser':
+        try:
+            kaiserBeta = float(kaiserBeta)
+        except (TypeError, ValueError):
+            raise ValueError('float beta value is needed for kaiser windowing')
+    else:
+        kaiserBeta = None # does not change the window
+
+    key = (windowType, size, normalisation, kaiserBeta, np.dtype(dtype))
+    return windowCache.get(key, lambda: _makeWindow(*key))
+
+def _makeWindow(windowType, size, normalisation, kaiserBeta, dtype):
+    """ Create a window function """
+    if   windowType == 'blackman':    windowFunction = np.blackman(size)
+    elif windowType == 'bartlett':    windowFunction = np.bartlett(size)
+    elif windowType == 'hamming':     windowFunction = np.hamming(size)
+    elif windowType == 'hanning':     windowFunction = np.hanning(size)
+    elif windowType == 'kaiser':      windowFunction = np.kaiser(size, kaiserBeta)
+    elif windowType == 'rectangular': windowFunction = np.ones((size))
+    elif windowType == 'trapazoid':
+        m1 = size // 4
+        m2 = size * 3 // 4
+        slope = 4.0 / (size - 1)
+        windowFunction = np.ones(size)
+        windowFunction[:m1] = np.arange(m1) * slope
+        windowFunction[m2:] = 4.0 - np.arange(size - m2) * slope
+
+    windowFunction = np.array(windowFunction, ndmin = 2)
+
+    # normalise if needed
+    if normalisation == 'none':
+        pass
+    elif normalisation == 'sum':
+        windowFunction = windowFunction / np.sum(windowFunction)
+    elif normalisation == 'square sum':
+        windowFunction = windowFunction / np.sum(np.square(windowFunction))
+
+    windowFunction = np.ascontiguousarray(windowFunction, dtype = dtype)
+    windowFunction.flags.writeable = False
+    return windowFunction